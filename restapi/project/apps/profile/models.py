@@ -31,5 +31,9 @@ class User(AbstractBaseUser):
     def __str__(self):
         return self.email
 
+    @property
+    def is_admin(self):
+        return self.permission == self.ADMIN_USER
+
     USERNAME_FIELD = 'phone'
     REQUIRED_FIELDS = []
@@ -1 +1,36 @@
+from django import forms
+from django.contrib import admin
+from django.core.exceptions import ValidationError
 
+from project.apps.tasks.models import Task
+
+
+class TaskAdminForm(forms.ModelForm):
+    class Meta:
+        model = Task
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        preconditions = cleaned_data.get('preconditions')
+        owner = cleaned_data.get('owner')
+        if preconditions is not None and owner is not None:
+            try:
+                self.instance.clean_preconditions(preconditions, owner=owner)
+            except ValidationError as e:
+                self.add_error('preconditions', e)
+        return cleaned_data
+
+
+class TaskAdmin(admin.ModelAdmin):
+    form = TaskAdminForm
+    list_display = ('title', 'owner', 'send_time', 'status', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('title', 'owner__email')
+    raw_id_fields = ('owner',)
+    autocomplete_fields = ('preconditions',)
+    readonly_fields = ('status', 'sent_at')
+    ordering = ('owner', 'topo_order')
+
+
+admin.site.register(Task, TaskAdmin)
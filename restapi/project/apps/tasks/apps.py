@@ -6,4 +6,9 @@ class TasksConfig(AppConfig):
     name = 'project.apps.tasks'
 
     def ready(self):
-        pass
+        from project.apps.tasks import signals  # noqa: F401
+        from project.settings import VALUES
+
+        if VALUES['IS_ENABLE_METRICS']:
+            from project.exception_rates import register_collector
+            register_collector()
@@ -0,0 +1,22 @@
+"""
+Sending tasks at their time.
+
+A dispatch backend keeps the due times of pending tasks and hands them out in leased batches:
+`schedule`, `schedule_many`, `cancel`, `claim`, `ack` and `requeue_expired`. The dispatcher
+drains whichever backend `TASKS_DISPATCH_BACKEND` names.
+"""
+from functools import lru_cache
+
+from project.settings import VALUES
+
+
+@lru_cache(maxsize=None)
+def get_backend(name=None):
+    name = name or VALUES['TASKS_DISPATCH_BACKEND']
+    if name == 'redis':
+        from .redis_queue import RedisDueQueue
+        return RedisDueQueue(VALUES['TASKS_DISPATCH_QUEUE_KEY'], lease_seconds=VALUES['TASKS_DISPATCH_LEASE'])
+    if name == 'database':
+        from .database_queue import DatabaseDueQueue
+        return DatabaseDueQueue(lease_seconds=VALUES['TASKS_DISPATCH_LEASE'])
+    raise ValueError(f'Unknown dispatch backend: {name}.')
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from project.apps.tasks.models import Task
+
+
+class DatabaseDueQueue:
+    """
+    The task table itself as the due queue, for deployments without a durable redis.
+
+    A claim locks the earliest due pending rows with `FOR UPDATE SKIP LOCKED`, walking the
+    partial index on pending tasks, and stamps a lease on them in the same short transaction.
+    Concurrent dispatchers skip each other's rows instead of waiting on them, and a lease that
+    runs out simply makes its rows claimable again. No transaction is held while tasks are
+    delivered, so a pooled (django_db_geventpool) connection goes back to the pool between
+    claims as soon as the dispatcher closes old connections.
+    """
+
+    def __init__(self, lease_seconds, queryset=None):
+        self.lease_seconds = lease_seconds
+        self.queryset = Task.objects.all() if queryset is None else queryset
+
+    def schedule(self, task_id, send_time):
+        """ nothing to do: a saved pending task is already in the queue, at its send time. """
+
+    def schedule_many(self, entries):
+        """ nothing to do: bulk created tasks are already in the queue. """
+
+    def cancel(self, task_id):
+        """ nothing to do: a task leaves the queue by no longer being pending, or by being deleted. """
+
+    def claim(self, limit, until=None, lease_seconds=None):
+        """ lease up to `limit` tasks due before `until`; returns (task id, due timestamp) pairs. """
+        current = now()
+        lease_seconds = self.lease_seconds if lease_seconds is None else lease_seconds
+        until = current if until is None else datetime.fromtimestamp(until, tz=dt_timezone.utc)
+        with transaction.atomic():
+            due = list(
+                self.queryset.select_for_update(skip_locked=True)
+                .filter(status=Task.PENDING, send_time__lte=until)
+                .filter(Q(leased_until__isnull=True) | Q(leased_until__lt=current))
+                .order_by('send_time', 'id')
+                .values_list('id', 'send_time')[:limit]
+            )
+            if due:
+                Task.objects.filter(pk__in=[task_id for task_id, _ in due]).update(
+                    leased_until=current + timedelta(seconds=lease_seconds)
+                )
+        return [(task_id, send_time.timestamp()) for task_id, send_time in due]
+
+    def ack(self, task_ids):
+        if task_ids:
+            Task.objects.filter(pk__in=task_ids).update(leased_until=None)
+
+    def requeue_expired(self, limit=1000):
+        """ expired leases are claimable as they are. """
+        return 0
+
+    def size(self):
+        return self.queryset.filter(status=Task.PENDING).count()
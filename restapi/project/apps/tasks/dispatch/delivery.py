@@ -0,0 +1,127 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import getLogger
+
+from django.core.mail import EmailMessage, get_connection
+
+from project.outgoing_logger import wrap_request
+
+logger = getLogger('jobs_logger')
+
+
+class SmtpPool:
+    """
+    A bounded set of open mail connections shared by the senders of one dispatcher.
+
+    Connections stay open between batches, so the TCP, TLS and AUTH handshakes are paid once per
+    connection instead of once per message. A connection that fails is closed and replaced on
+    the next checkout, and an idle one is checked with a NOOP before it is handed out, since
+    mail servers drop connections that idle past their timeout. Under gevent the semaphore and
+    queue are cooperative, so at most `size` greenlets talk to the mail server at a time and the
+    rest wait without blocking the hub.
+    """
+
+    def __init__(self, size, backend=None):
+        self.size = size
+        self.backend = backend
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = None
+            if connection is not None and not alive(connection):
+                connection.close()
+                connection = None
+            if connection is None:
+                connection = get_connection(self.backend, fail_silently=False)
+                connection.open()
+            try:
+                yield connection
+            except Exception:
+                connection.close()
+                raise
+            self.idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                connection.close()
+            except Exception as e:
+                logger.exception(e)
+
+
+def alive(connection):
+    """ whether a pooled connection still answers; backends without an SMTP session always do. """
+    session = getattr(connection, 'connection', None)
+    if session is None:
+        return True
+    try:
+        return session.noop()[0] == 250
+    except Exception:
+        return False
+
+
+def build_message(task):
+    return EmailMessage(subject=task.title, body=task.description, to=[task.owner.email])
+
+
+class EmailDelivery:
+    """
+    Email each task to its owner over a `SmtpPool`.
+
+    A batch is cut into runs of `messages_per_send` messages that are written back to back on one
+    connection (no reconnect in between) and the runs are sent concurrently, one per pooled
+    connection.
+    """
+
+    def __init__(self, pool_size, messages_per_send, backend=None):
+        self.pool = SmtpPool(pool_size, backend=backend)
+        self.messages_per_send = messages_per_send
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def send(self, tasks, request_id=None):
+        """ returns the ids of the tasks whose email was accepted by the mail server. """
+        runs = [tasks[i:i + self.messages_per_send] for i in range(0, len(tasks), self.messages_per_send)]
+        sent = []
+        for task_ids in self.executor.map(lambda run: self.send_run(run, request_id), runs):
+            sent.extend(task_ids)
+        return sent
+
+    def send_run(self, tasks, request_id):
+        """
+        Send a run's messages one after another on one connection; the ids of those accepted
+        before the first failure, so a retry does not send them again.
+        """
+        messages = {task.pk: build_message(task) for task in tasks}
+        sent = []
+
+        def send_messages(connection, task_ids):
+            for task_id in task_ids:
+                connection.send_messages([messages[task_id]])
+                sent.append(task_id)
+            return len(sent)
+
+        try:
+            with self.pool.connection() as connection:
+                wrap_request(
+                    provider='smtp', func=lambda task_ids: send_messages(connection, task_ids),
+                    args=[list(messages)], request_id=request_id, action='send_messages',
+                )
+        except Exception as e:
+            logger.exception(e)
+        return sent
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
@@ -0,0 +1,144 @@
+import time
+from datetime import timedelta
+from logging import getLogger
+
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from project.apps.tasks.models import Task
+from project.apps.tasks.versions import bump_task_versions
+from .timing_wheel import TimingWheel
+
+logger = getLogger('jobs_logger')
+
+# a timer may fire a hair before the wall clock reaches the send time.
+EARLY_TOLERANCE = timedelta(seconds=1)
+
+
+def waves(task_ids, after):
+    """ group `task_ids` (listed preconditions first) so every task comes in a later wave than those it is after. """
+    depths = {}
+    for task_id in task_ids:
+        depths[task_id] = max((depths[ancestor_id] + 1 for ancestor_id in after[task_id]), default=0)
+    grouped = [[] for _ in range(max(depths.values(), default=-1) + 1)]
+    for task_id in task_ids:
+        grouped[depths[task_id]].append(task_id)
+    return grouped
+
+
+class Dispatcher:
+    """ drain due tasks from a dispatch backend in leased batches. """
+
+    def __init__(self, backend, batch_size, poll_interval, delivery=None):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.delivery = delivery
+
+    def run_once(self):
+        self.backend.requeue_expired()
+        claimed = self.backend.claim(self.batch_size)
+        if not claimed:
+            return 0
+        task_ids = [task_id for task_id, _ in claimed]
+        self.backend.ack(self.deliver(task_ids))
+        return len(task_ids)
+
+    def deliver(self, task_ids):
+        """
+        Send the claimed tasks whose preconditions were all sent on time and mark the rest not done.
+        Tasks moved to a later time after they were claimed are left for their new time.
+
+        A task whose precondition is in the same batch is sent in a later wave than it, and only
+        if it was sent. Returns the ids to ack: everything except the tasks whose email could not
+        be sent and their dependents, which stay leased and are retried once their lease runs out.
+        """
+        current = now()
+        due = Task.objects.filter(pk__in=task_ids, send_time__lte=current + EARLY_TOLERANCE).values_list('pk', flat=True)
+        ready, blocked, owners, after = Task.objects.resolve_preconditions(due, current)
+        unsent = set()
+        if self.delivery is not None and ready:
+            tasks = {task.pk: task for task in Task.objects.filter(pk__in=ready).select_related('owner')
+                     .only('pk', 'title', 'description', 'owner__email')}
+            for wave in waves(ready, after):
+                held = [task_id for task_id in wave if unsent.intersection(after[task_id])]
+                unsent.update(held)
+                sending = [tasks[task_id] for task_id in wave if task_id not in unsent]
+                if sending:
+                    unsent.update({task.pk for task in sending}.difference(self.delivery.send(sending)))
+            ready = [task_id for task_id in ready if task_id not in unsent]
+        sent = Task.objects.filter(pk__in=ready, status=Task.PENDING).update(status=Task.DONE, sent_at=current)
+        failed = Task.objects.filter(pk__in=blocked, status=Task.PENDING).update(status=Task.NOT_DONE)
+        if sent or failed:
+            bump_task_versions(owners)
+        logger.info('', extra={'action': 'deliver', 'claimed': len(task_ids), 'sent': sent, 'failed': failed,
+                               'unsent': len(unsent)})
+        return [task_id for task_id in task_ids if task_id not in unsent]
+
+    def run_forever(self):
+        while True:
+            close_old_connections()
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                logger.exception(e)
+                processed = 0
+            if processed < self.batch_size:
+                time.sleep(self.poll_interval)
+
+
+class WheelDispatcher(Dispatcher):
+    """
+    Hold the tasks due within `horizon` seconds in a timing wheel and send each at its time.
+
+    The durable backend is read in bulk once per `refill_interval`, leasing the claimed tasks
+    for the whole horizon, and the wheel fires them with millisecond accuracy in between. A task
+    created closer to its time than one refill interval is picked up by the next refill.
+    Sleeping goes through `time.sleep`, which gunicorn's gevent monkey patching makes a
+    cooperative yield.
+    """
+
+    def __init__(self, backend, batch_size, poll_interval, horizon, refill_interval, delivery=None,
+                 clock=time.monotonic):
+        super().__init__(backend, batch_size, poll_interval, delivery=delivery)
+        self.horizon = horizon
+        self.refill_interval = refill_interval
+        self.clock = clock
+        self.wheel = TimingWheel(start=clock())
+        self.next_refill = clock()
+
+    def refill(self):
+        offset = self.clock() - time.time()
+        until = time.time() + self.horizon
+        lease_seconds = self.horizon + self.backend.lease_seconds
+        refilled = 0
+        while True:
+            claimed = self.backend.claim(self.batch_size, until=until, lease_seconds=lease_seconds)
+            for task_id, due in claimed:
+                self.wheel.add(due + offset, task_id)
+            refilled += len(claimed)
+            if len(claimed) < self.batch_size:
+                return refilled
+
+    def run_once(self):
+        if self.clock() >= self.next_refill:
+            self.backend.requeue_expired()
+            self.refill()
+            self.next_refill = self.clock() + self.refill_interval
+        task_ids = self.wheel.advance(self.clock())
+        if task_ids:
+            self.backend.ack(self.deliver(task_ids))
+        return len(task_ids)
+
+    def run_forever(self):
+        while True:
+            close_old_connections()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(e)
+            wake = self.next_refill
+            next_expiry = self.wheel.next_expiry()
+            if next_expiry is not None:
+                wake = min(wake, next_expiry)
+            time.sleep(max(0, wake - self.clock()))
@@ -0,0 +1,89 @@
+import time
+
+from django.conf import settings
+
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+for i = 1, #due, 2 do
+    redis.call('ZREM', KEYS[1], due[i])
+    redis.call('ZADD', KEYS[2], ARGV[3], due[i])
+    redis.call('HSET', KEYS[3], due[i], due[i + 1])
+end
+return due
+"""
+
+REQUEUE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(expired) do
+    local score = redis.call('HGET', KEYS[3], member) or ARGV[1]
+    -- NX: a task rescheduled while it was leased keeps its new due time
+    redis.call('ZADD', KEYS[1], 'NX', score, member)
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('HDEL', KEYS[3], member)
+end
+return #expired
+"""
+
+
+class RedisDueQueue:
+    """
+    Due times of pending tasks in a redis sorted set.
+
+    Claiming atomically moves a batch of due members to a lease set scored by lease expiry, so
+    concurrent dispatchers never get the same task; leases that run out without an ack are put
+    back with their original due time, unless the task was rescheduled meanwhile. Every
+    operation is O(log n) per task.
+    """
+
+    def __init__(self, key, lease_seconds, connection=None):
+        # the hash tag keeps the three keys on one cluster slot for the scripts.
+        self.due_key = f'{{{key}}}:due'
+        self.lease_key = f'{{{key}}}:leases'
+        self.leased_due_key = f'{{{key}}}:leased-due'
+        self.lease_seconds = lease_seconds
+        self.connection = connection or settings.REDIS_CONNECTION
+        self._claim = self.connection.register_script(CLAIM_SCRIPT)
+        self._requeue = self.connection.register_script(REQUEUE_SCRIPT)
+
+    @property
+    def keys(self):
+        return [self.due_key, self.lease_key, self.leased_due_key]
+
+    def schedule(self, task_id, send_time):
+        """ a task already in the queue just gets its score moved, never a second entry. """
+        self.connection.zadd(self.due_key, {task_id: send_time.timestamp()})
+
+    def schedule_many(self, entries):
+        """ entries are (task id, send time) pairs, added in one call. """
+        mapping = {task_id: send_time.timestamp() for task_id, send_time in entries}
+        if mapping:
+            self.connection.zadd(self.due_key, mapping)
+
+    def cancel(self, task_id):
+        pipeline = self.connection.pipeline()
+        pipeline.zrem(self.due_key, task_id)
+        pipeline.zrem(self.lease_key, task_id)
+        pipeline.hdel(self.leased_due_key, task_id)
+        pipeline.execute()
+
+    def claim(self, limit, until=None, lease_seconds=None):
+        """ lease up to `limit` tasks due before `until`; returns (task id, due timestamp) pairs. """
+        now = time.time()
+        until = now if until is None else until
+        lease_seconds = self.lease_seconds if lease_seconds is None else lease_seconds
+        due = self._claim(keys=self.keys, args=[until, limit, now + lease_seconds])
+        return [(int(due[i]), float(due[i + 1])) for i in range(0, len(due), 2)]
+
+    def ack(self, task_ids):
+        if not task_ids:
+            return
+        pipeline = self.connection.pipeline()
+        pipeline.zrem(self.lease_key, *task_ids)
+        pipeline.hdel(self.leased_due_key, *task_ids)
+        pipeline.execute()
+
+    def requeue_expired(self, limit=1000):
+        return self._requeue(keys=self.keys, args=[time.time(), limit])
+
+    def size(self):
+        return self.connection.zcard(self.due_key)
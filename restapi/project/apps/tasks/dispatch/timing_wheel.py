@@ -0,0 +1,109 @@
+class Timer:
+    __slots__ = ('tick', 'payload', 'bucket')
+
+    def __init__(self, tick, payload):
+        self.tick = tick
+        self.payload = payload
+        self.bucket = None
+
+    def cancel(self):
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel (Varghese & Lauck) for timers in the near future.
+
+    Level 0 has one slot per tick, every higher level one slot per full turn of the level below.
+    A timer goes to the lowest level whose turn still reaches it and is cascaded one level down
+    when the clock enters its slot, so adding and cancelling are O(1) and every timer is moved at
+    most `levels` times. Timers past the last level wait in an overflow set. Times are in seconds
+    of whatever monotonic clock the caller advances it with.
+
+    It is not thread-safe: one dispatcher greenlet owns it and does all adds and advances.
+    """
+
+    def __init__(self, start, tick=0.001, slots=256, levels=3):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int(start / tick)
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.overflow = set()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, deadline, payload):
+        timer = Timer(max(int(deadline / self.tick), self.current), payload)
+        self._place(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        if timer.bucket is not None:
+            timer.cancel()
+            self.count -= 1
+
+    def _place(self, timer):
+        span = 1
+        for wheel in self.wheels:
+            if timer.tick // span - self.current // span < self.slots:
+                bucket = wheel[(timer.tick // span) % self.slots]
+                break
+            span *= self.slots
+        else:
+            bucket = self.overflow
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def _cascade(self):
+        """ entering a new turn of a level moves the timers of its current slot one level down. """
+        span = self.slots ** self.levels
+        if self.current % span == 0:
+            self._replace(self.overflow)
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if self.current % span == 0:
+                self._replace(self.wheels[level][(self.current // span) % self.slots])
+
+    def _replace(self, bucket):
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            self._place(timer)
+
+    def advance(self, now):
+        """ move the clock to `now` and return the payloads of every timer that came due. """
+        target = int(now / self.tick)
+        expired = []
+        while self.current <= target:
+            if self.count == 0:
+                self.current = target + 1
+                break
+            self._cascade()
+            bucket = self.wheels[0][self.current % self.slots]
+            if bucket:
+                for timer in bucket:
+                    timer.bucket = None
+                    expired.append(timer.payload)
+                self.count -= len(bucket)
+                bucket.clear()
+            self.current += 1
+        return expired
+
+    def next_expiry(self):
+        """ the earliest time something may fire: exact within level 0, else the next cascade. """
+        if self.count == 0:
+            return None
+        if self.current % self.slots == 0:
+            # the cascade into this turn has not run yet
+            return self.current * self.tick
+        level0 = self.wheels[0]
+        for offset in range(self.slots - self.current % self.slots):
+            if level0[(self.current + offset) % self.slots]:
+                return (self.current + offset) * self.tick
+        return (self.current + self.slots - self.current % self.slots) * self.tick
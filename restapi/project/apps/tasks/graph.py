@@ -0,0 +1,252 @@
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from hashlib import sha256
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class TaskGraphError(ValueError):
+    pass
+
+
+def parse_send_time(value):
+    """ accept both the api datetime output ('%s.%f' epoch) and iso-8601 strings. """
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        return from_timestamp(value)
+    elif isinstance(value, str):
+        try:
+            timestamp = float(value)
+        except ValueError:
+            try:
+                parsed = parse_datetime(value)
+            except ValueError:
+                # well formatted, but not a date (e.g. month 13)
+                parsed = None
+        else:
+            return from_timestamp(timestamp)
+        if parsed is None:
+            raise TaskGraphError(f'Invalid send_time: {value!r}.')
+    else:
+        raise TaskGraphError(f'Invalid send_time: {value!r}.')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def from_timestamp(timestamp):
+    try:
+        return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        # out of the range of datetime, or nan
+        raise TaskGraphError(f'Invalid send_time: {timestamp!r}.')
+
+
+class TaskGraph:
+    """
+    Precondition graph of a set of tasks, built once and indexed densely.
+
+    Nodes are addressed by their position in `ids`; `successors[i]` holds the nodes that have
+    node i as a precondition. Preconditions outside the set are dropped while building.
+    """
+    __slots__ = ('ids', 'send_times', 'successors', 'edge_count')
+
+    def __init__(self, ids, send_times, successors, edge_count):
+        self.ids = ids
+        self.send_times = send_times
+        self.successors = successors
+        self.edge_count = edge_count
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_tasks(cls, tasks):
+        """ build from an iterable of {'id', 'send_time', 'preconditions'} mappings. """
+        ids, send_times, preconditions, index = [], [], [], {}
+        for position, task in enumerate(tasks):
+            try:
+                task_id = task['id']
+                send_time = parse_send_time(task['send_time'])
+                task_preconditions = task.get('preconditions') or ()
+            except (KeyError, TypeError, AttributeError):
+                raise TaskGraphError(f'Task #{position} must have "id" and "send_time".')
+            if not isinstance(task_id, (int, str)) or isinstance(task_id, bool):
+                raise TaskGraphError(f'Task #{position} has an invalid id.')
+            if not isinstance(task_preconditions, (list, tuple)):
+                raise TaskGraphError(f'Preconditions of task {task_id} must be a list.')
+            if task_id in index:
+                raise TaskGraphError(f'Task {task_id} is repeated.')
+            index[task_id] = position
+            ids.append(task_id)
+            send_times.append(send_time)
+            preconditions.append(task_preconditions)
+
+        successors = [[] for _ in ids]
+        edge_count = 0
+        for position, task_preconditions in enumerate(preconditions):
+            for precondition in set(task_preconditions):
+                source = index.get(precondition)
+                if source is not None:
+                    successors[source].append(position)
+                    edge_count += 1
+        return cls(ids, send_times, successors, edge_count)
+
+    def edges(self):
+        for source, targets in enumerate(self.successors):
+            for target in targets:
+                yield source, target
+
+    def fingerprint(self):
+        """
+        Hash of the (id, send time, in-set preconditions) of every task, independent of the order
+        tasks and preconditions were listed in. Ids keep their type, so 1 and "1" differ.
+        """
+        keys = [repr(task_id) for task_id in self.ids]
+        preconditions = [[] for _ in keys]
+        for source, targets in enumerate(self.successors):
+            for target in targets:
+                preconditions[target].append(keys[source])
+        rows = sorted(
+            f'{key}\t{send_time.timestamp()!r}\t{",".join(sorted(task_preconditions))}'
+            for key, send_time, task_preconditions in zip(keys, self.send_times, preconditions)
+        )
+        return sha256('\n'.join(rows).encode()).hexdigest()
+
+
+def _kahn(graph):
+    """ Kahn's algorithm; nodes on or after a cycle are never released and are left out. """
+    indegree = [0] * len(graph)
+    for targets in graph.successors:
+        for target in targets:
+            indegree[target] += 1
+    queue = deque(node for node, degree in enumerate(indegree) if degree == 0)
+    order = []
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        for target in graph.successors[node]:
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                queue.append(target)
+    return order
+
+
+def topological_order(graph):
+    """ returns node positions in dependency order or None when there is a cycle. """
+    order = _kahn(graph)
+    if len(order) != len(graph):
+        return None
+    return order
+
+
+def strongly_connected_components(graph):
+    """ iterative Tarjan, O(V+E) without touching the recursion limit. """
+    size = len(graph)
+    index, low, on_stack = [None] * size, [0] * size, [False] * size
+    stack, components, counter = [], [], 0
+    for root in range(size):
+        if index[root] is not None:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            node, position = work[-1]
+            successors = graph.successors[node]
+            if position < len(successors):
+                work[-1] = (node, position + 1)
+                child = successors[position]
+                if index[child] is None:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, 0))
+                elif on_stack[child]:
+                    low[node] = min(low[node], index[child])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
+def feasible_order(graph):
+    """
+    Decide whether the task set can be done, in O(V+E).
+
+    Every in-set precondition must be sent strictly before its dependent and the precondition
+    graph must be acyclic. Returns the node positions in the order they will happen, or None.
+    """
+    send_times = graph.send_times
+    for source, target in graph.edges():
+        if send_times[source] >= send_times[target]:
+            return None
+    return topological_order(graph)
+
+
+def validate(graph):
+    """ the task ids of a feasible set in the order they will happen, or None. """
+    order = feasible_order(graph)
+    if order is None:
+        return None
+    return [graph.ids[node] for node in order]
+
+
+def explain(graph, gap):
+    """
+    Everything that makes a task set infeasible, in one O(V+E) pass.
+
+    Returns the precondition edges whose send times are out of order, the cycles (strongly
+    connected components), and the longest dependency chain with the earliest time every task
+    on it can be sent, `gap` being the least time between a precondition and its dependent.
+    Tasks on or after a cycle have no earliest time and are not part of the chain.
+    """
+    ids, send_times, successors = graph.ids, graph.send_times, graph.successors
+    violations = [
+        (ids[source], ids[target]) for source, target in graph.edges() if send_times[source] >= send_times[target]
+    ]
+    cycles = [
+        [ids[node] for node in reversed(component)]
+        for component in strongly_connected_components(graph)
+        if len(component) > 1 or component[0] in successors[component[0]]
+    ]
+
+    order = _kahn(graph)
+    earliest = list(send_times)
+    depth = [1] * len(graph)
+    parent = [None] * len(graph)
+    for node in order:
+        for target in successors[node]:
+            earliest[target] = max(earliest[target], earliest[node] + gap)
+            if depth[node] + 1 > depth[target]:
+                depth[target] = depth[node] + 1
+                parent[target] = node
+    critical_path = []
+    if order:
+        node = max(order, key=depth.__getitem__)
+        while node is not None:
+            critical_path.append((ids[node], send_times[node], earliest[node]))
+            node = parent[node]
+        critical_path.reverse()
+
+    return {
+        'violations': violations,
+        'cycles': cycles,
+        'critical_path': critical_path,
+    }
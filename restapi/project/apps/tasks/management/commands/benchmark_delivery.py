@@ -0,0 +1,42 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from project.apps.tasks.dispatch.delivery import EmailDelivery, build_message
+from project.apps.tasks.models import Task
+from project.settings import VALUES
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare sending task emails over a new connection each against the pooled delivery. '
+        'Point EMAIL_HOST/EMAIL_PORT at a local stand-in, e.g. `python -m aiosmtpd -n -l localhost:8025`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--pool-size', type=int, default=VALUES['TASKS_SMTP_POOL_SIZE'])
+        parser.add_argument('--messages-per-send', type=int, default=VALUES['TASKS_SMTP_MESSAGES_PER_SEND'])
+        parser.add_argument('--backend', default=None, help='email backend, EMAIL_BACKEND by default')
+
+    def handle(self, *args, **options):
+        owner = get_user_model()(email='benchmark@benchmark.local')
+        tasks = [Task(pk=i, title=f'benchmark {i}', description='benchmark', owner=owner) for i in range(options['messages'])]
+
+        start = time.perf_counter()
+        for task in tasks:
+            get_connection(options['backend'], fail_silently=False).send_messages([build_message(task)])
+        self.report('connection per message', len(tasks), time.perf_counter() - start)
+
+        delivery = EmailDelivery(options['pool_size'], options['messages_per_send'], backend=options['backend'])
+        try:
+            start = time.perf_counter()
+            sent = delivery.send(tasks)
+            self.report('pooled', len(sent), time.perf_counter() - start)
+        finally:
+            delivery.close()
+
+    def report(self, name, sent, elapsed):
+        self.stdout.write(f'{name}: sent {sent} emails in {elapsed:.3f}s, {sent / elapsed:.0f} emails/s')
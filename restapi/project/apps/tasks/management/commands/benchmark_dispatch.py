@@ -0,0 +1,64 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.timezone import now
+
+from project.apps.tasks.dispatch.database_queue import DatabaseDueQueue
+from project.apps.tasks.dispatch.redis_queue import RedisDueQueue
+from project.apps.tasks.models import Task
+
+
+class Command(BaseCommand):
+    help = 'Compare the claim throughput of the redis and database dispatch backends.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        owner = get_user_model().objects.create(email=f'benchmark-{time.time()}@benchmark.local')
+        try:
+            due = now() - timedelta(minutes=1)
+            tasks = Task.objects.bulk_create(
+                [Task(title=f'benchmark {i}', owner=owner, send_time=due + timedelta(microseconds=i)) for i in range(options['tasks'])],
+                batch_size=1000,
+            )
+            queryset = Task.objects.filter(owner=owner)
+            redis_queue = RedisDueQueue('benchmark-tasks-dispatch', lease_seconds=60)
+            redis_queue.schedule_many((task.pk, task.send_time) for task in tasks)
+            try:
+                for name, backend in (('redis', redis_queue), ('database', DatabaseDueQueue(lease_seconds=60, queryset=queryset))):
+                    queryset.update(status=Task.PENDING, leased_until=None)
+                    claimed, elapsed = self.drain(backend, options['batch_size'], options['workers'])
+                    self.stdout.write(f'{name}: claimed {claimed} tasks in {elapsed:.3f}s, {claimed / elapsed:.0f} tasks/s')
+            finally:
+                redis_queue.connection.delete(*redis_queue.keys)
+        finally:
+            owner.delete()
+
+    @staticmethod
+    def drain(backend, batch_size, workers):
+        def worker():
+            count = 0
+            try:
+                while True:
+                    claimed = backend.claim(batch_size)
+                    if not claimed:
+                        return count
+                    task_ids = [task_id for task_id, _ in claimed]
+                    # what the dispatcher does with a batch, minus the delivery itself.
+                    Task.objects.filter(pk__in=task_ids).update(status=Task.DONE)
+                    backend.ack(task_ids)
+                    count += len(claimed)
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            claimed = sum(executor.map(lambda _: worker(), range(workers)))
+        return claimed, time.perf_counter() - start
@@ -0,0 +1,60 @@
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from project.json_log import TaskSchedulerJsonFormatter
+from project.kafka_log import InMemoryBroker, KafkaHandler, KafkaShipper
+
+
+class Command(BaseCommand):
+    help = 'Ship request-log sized records through the kafka log handler to the in-memory broker, up and then down.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--send-delay', type=float, default=0.005, help='seconds each batch takes to send')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            broker = InMemoryBroker(delay=options['send_delay'])
+            shipper = KafkaShipper(lambda: broker, max_records=options['records'], batch_size=options['batch_size'],
+                                   flush_interval=0.01, spill_path=os.path.join(directory, 'spill.log'),
+                                   spill_max_bytes=1024 ** 3, retry_interval=3600)
+            handler = KafkaHandler('benchmark', shipper=shipper)
+            handler.setFormatter(TaskSchedulerJsonFormatter())
+
+            self.report('broker up', self.run(handler, options['records']))
+            self.wait(shipper, 'sent', lambda: len(broker.topics['benchmark']) < options['records'])
+
+            broker.down = True
+            self.report('broker down', self.run(handler, options['records']))
+            self.wait(shipper, 'spilled', lambda: shipper.records)
+            self.stdout.write(f'spill file: {os.path.getsize(shipper.spill_path) / 1024 ** 2:.1f}MB')
+
+    @staticmethod
+    def run(handler, count):
+        extra = {'request_id': '0f8b3c2a9d4e4f6b8a1c2d3e4f5a6b7c', 'request_method': 'GET', 'route_name': 'task_list',
+                 'response_status': 200, 'run_time': 0.012, 'request_body': {}, 'params': {'limit': '10'}}
+        timings = []
+        for i in range(count):
+            record = logging.LogRecord('requests_logger', logging.INFO, __file__, 0, '', None, None)
+            record.__dict__.update(extra)
+            start = time.perf_counter()
+            handler.handle(record)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def wait(self, shipper, outcome, pending):
+        start = time.perf_counter()
+        while pending():
+            time.sleep(0.01)
+        self.stdout.write(f'  {outcome} the backlog {time.perf_counter() - start:.3f}s later')
+
+    def report(self, name, timings):
+        quantiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(f'{name}: {len(timings)} records, emit p50 {quantiles[49] * 1e6:.1f}us, '
+                          f'p99 {quantiles[98] * 1e6:.1f}us, max {max(timings) * 1e6:.1f}us')
@@ -0,0 +1,75 @@
+import copy
+import timeit
+from re import IGNORECASE, match
+
+from django.core.management.base import BaseCommand
+
+from project.tools import mask_sensitive_args
+
+PATTERNS = [r'.*password.*', r'.*refresh.*', r'.*code.*', r'.*token.*', r'.*secret.*']
+
+
+def legacy_mask_sensitive_args(data):
+    """ the masker this benchmark compares against: five uncompiled patterns per key, in place. """
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, (dict, list)):
+                legacy_mask_sensitive_args(value)
+            elif any([match(pattern, str(key), flags=IGNORECASE) for pattern in PATTERNS]):
+                data[key] = "*******"
+    elif isinstance(data, list):
+        for item in data:
+            legacy_mask_sensitive_args(item)
+    return data
+
+
+def request_log(tasks):
+    """ a request log entry of a bulk create with `tasks` tasks, shaped like ResponseLogMiddleware's. """
+    return {
+        'request_id': '0f8b3c2a9d4e4f6b8a1c2d3e4f5a6b7c',
+        'request_method': 'POST',
+        'remote_address': '10.0.0.1',
+        'server_hostname': 'restapi-1',
+        'request_path': '/api/v1/tasks/bulk-create/',
+        'request_user': '42',
+        'route_name': 'bulk_create',
+        'run_time': 0.0123,
+        'response_status': 201,
+        'request_body': {
+            'owner': 42,
+            'tasks': [
+                {'ref': f'task-{i}', 'title': f'task {i}', 'description': 'send the weekly report',
+                 'send_time': '2024-05-10T10:30:00Z', 'preconditions': [f'task-{i - 1}'] if i else []}
+                for i in range(tasks)
+            ],
+        },
+        'params': {},
+        'device': 'android',
+    }
+
+
+def provider_call():
+    """ args and kwargs of an outgoing call, as wrap_request masks them. """
+    return [['+989120000000', {'template': 'verify', 'code': '123456', 'tokens': ['a', 'b']}],
+            {'headers': {'Authorization': 'Bearer x', 'X-Api-Token': 'y'}, 'timeout': 5, 'retries': 2}]
+
+
+class Command(BaseCommand):
+    help = 'Time the sensitive-data masker against the previous in-place implementation on request log shaped payloads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        payloads = {
+            'provider call': provider_call(),
+            'login request': request_log(0) | {'request_body': {'phone': '09120000000', 'password': 'p', 'code': '1234'}},
+            'bulk create, 100 tasks': request_log(100),
+        }
+        for name, payload in payloads.items():
+            number = max(options['number'] // (1 + len(str(payload)) // 1000), 10)
+            # the old masker changed its argument, so every run gets a fresh copy, made outside the timing
+            copies = [copy.deepcopy(payload) for _ in range(number)]
+            legacy = timeit.timeit(lambda: legacy_mask_sensitive_args(copies.pop()), number=number) / number
+            masked = timeit.timeit(lambda: mask_sensitive_args(payload), number=number) / number
+            self.stdout.write(f'{name}: legacy {legacy * 1e6:.1f}us, masker {masked * 1e6:.1f}us, {legacy / masked:.1f}x')
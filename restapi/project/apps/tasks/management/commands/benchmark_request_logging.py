@@ -0,0 +1,79 @@
+import logging
+import statistics
+import tempfile
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+
+from middleware import ResponseLogMiddleware
+from project.json_log import TaskSchedulerJsonFormatter
+from project.log_queue import LogQueue, QueuedHandler
+
+
+class SlowStream:
+    """ a file whose writes take `delay` seconds, like a busy disk. """
+
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class Command(BaseCommand):
+    help = 'Compare request latency through ResponseLogMiddleware with the request log written inline and through the log queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--write-delay', type=float, default=0.0005, help='seconds each log write takes')
+
+    def handle(self, *args, **options):
+        requests_logger = logging.getLogger('requests_logger')
+        handlers, propagate = requests_logger.handlers[:], requests_logger.propagate
+        requests_logger.propagate = False
+        try:
+            with tempfile.TemporaryFile('w') as file:
+                handler = logging.StreamHandler(SlowStream(file, options['write_delay']))
+                handler.name = 'benchmark'
+                handler.setFormatter(TaskSchedulerJsonFormatter())
+
+                requests_logger.handlers = [handler]
+                self.report('inline', self.run(options['requests']))
+
+                log_queue = LogQueue()
+                requests_logger.handlers = [QueuedHandler(handler, log_queue)]
+                self.report('queued', self.run(options['requests']))
+                start = time.perf_counter()
+                while log_queue.records:
+                    time.sleep(0.01)
+                self.stdout.write(f'queued: drained the backlog in another {time.perf_counter() - start:.3f}s')
+        finally:
+            requests_logger.handlers, requests_logger.propagate = handlers, propagate
+
+    @staticmethod
+    def run(count):
+        middleware = ResponseLogMiddleware(lambda request: HttpResponse('{}', content_type='application/json'))
+        factory = RequestFactory()
+        path = reverse('tasks:task_list')
+        timings = []
+        for i in range(count):
+            request = factory.post(path, {'title': f'task {i}', 'password': 'secret'}, content_type='application/json')
+            request.user = AnonymousUser()
+            start = time.perf_counter()
+            middleware(request)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def report(self, name, timings):
+        quantiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(f'{name}: {len(timings)} requests, p50 {quantiles[49] * 1000:.3f}ms, '
+                          f'p99 {quantiles[98] * 1000:.3f}ms, max {max(timings) * 1000:.3f}ms')
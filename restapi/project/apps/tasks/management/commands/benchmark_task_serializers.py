@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from django.utils.timezone import now
+
+from project.apps.tasks.models import Task
+from project.apps.tasks.v1.serializers import TaskRowSerializer, TaskSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare serializing a page of tasks with TaskSerializer against TaskRowSerializer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=1000, help='tasks in the page')
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        owner = get_user_model().objects.create(email=f'benchmark-{time.time()}@benchmark.local')
+        try:
+            send_time = now() + timedelta(days=1)
+            tasks = Task.objects.bulk_create(
+                [Task(title=f'benchmark {i}', description='benchmark', owner=owner, send_time=send_time + timedelta(seconds=i))
+                 for i in range(options['tasks'])],
+                batch_size=1000,
+            )
+            Edge = Task.preconditions.through
+            Edge.objects.bulk_create(
+                [Edge(from_task_id=task.pk, to_task_id=tasks[i // 2].pk) for i, task in enumerate(tasks) if i],
+                batch_size=1000,
+            )
+            queryset = Task.objects.filter(owner=owner).order_by('send_time', 'id')
+
+            def model_serializer():
+                page = queryset.prefetch_related(Prefetch('preconditions', queryset=Task.objects.only('id')))
+                return TaskSerializer(page, many=True).data
+
+            row_serializer = TaskRowSerializer()
+
+            def rows():
+                return row_serializer.serialize(list(row_serializer.values(queryset)))
+
+            for name, serialize in (('TaskSerializer', model_serializer), ('TaskRowSerializer', rows)):
+                start = time.perf_counter()
+                for _ in range(options['rounds']):
+                    serialize()
+                elapsed = (time.perf_counter() - start) / options['rounds']
+                self.stdout.write(f'{name}: {elapsed * 1000:.1f}ms per page of {len(tasks)} tasks')
+        finally:
+            Task.objects.filter(owner=owner).delete()
+            owner.delete()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from project.apps.tasks.dispatch import get_backend
+from project.apps.tasks.dispatch.delivery import EmailDelivery
+from project.apps.tasks.dispatch.dispatcher import Dispatcher, WheelDispatcher
+from project.settings import VALUES
+
+
+class Command(BaseCommand):
+    help = 'Send due tasks from the dispatch backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default=None, help='dispatch backend, TASKS_DISPATCH_BACKEND by default')
+        parser.add_argument('--batch-size', type=int, default=VALUES['TASKS_DISPATCH_BATCH_SIZE'])
+        parser.add_argument('--poll-interval', type=float, default=VALUES['TASKS_DISPATCH_POLL_INTERVAL'])
+        parser.add_argument('--horizon', type=float, default=VALUES['TASKS_DISPATCH_HORIZON'],
+                            help='seconds of upcoming tasks held in the timing wheel, 0 to poll instead')
+        parser.add_argument('--refill-interval', type=float, default=VALUES['TASKS_DISPATCH_REFILL_INTERVAL'])
+        parser.add_argument('--smtp-pool-size', type=int, default=VALUES['TASKS_SMTP_POOL_SIZE'])
+
+    def handle(self, *args, **options):
+        backend = get_backend(options['backend'])
+        delivery = EmailDelivery(options['smtp_pool_size'], VALUES['TASKS_SMTP_MESSAGES_PER_SEND'])
+        if options['horizon'] > 0:
+            dispatcher = WheelDispatcher(backend, options['batch_size'], options['poll_interval'],
+                                         horizon=options['horizon'], refill_interval=options['refill_interval'],
+                                         delivery=delivery)
+        else:
+            dispatcher = Dispatcher(backend, options['batch_size'], options['poll_interval'], delivery=delivery)
+        try:
+            dispatcher.run_forever()
+        finally:
+            delivery.close()
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.13 on 2026-10-18 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='title')),
+                ('description', models.TextField(blank=True, verbose_name='description')),
+                ('send_time', models.DateTimeField(verbose_name='time to send')),
+                ('status', models.SmallIntegerField(choices=[(1, 'pending'), (2, 'done'), (3, 'not done')], default=1)),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='sent at')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to=settings.AUTH_USER_MODEL)),
+                ('preconditions', models.ManyToManyField(blank=True, related_name='dependents', to='tasks.task')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaskClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paths', models.PositiveIntegerField(default=1)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='tasks.task')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='tasks.task')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='tasks_taskc_descend_63a27b_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='taskclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='tasks_closure_ancestor_descendant'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', 'send_time'], name='tasks_task_owner_i_d9f95e_idx'),
+        ),
+    ]
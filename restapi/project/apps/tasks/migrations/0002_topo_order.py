@@ -0,0 +1,47 @@
+# Generated by Django 4.2.13 on 2026-10-18 12:23
+
+from collections import deque
+from django.db import migrations, models
+
+
+def fill_topo_order(apps, schema_editor):
+    """ number the existing tasks in dependency order (Kahn), reusing their ids as positions. """
+    Task = apps.get_model('tasks', 'Task')
+    edges = list(Task.preconditions.through.objects.values_list('to_task_id', 'from_task_id'))
+    ids = sorted(Task.objects.values_list('id', flat=True))
+    successors = {task_id: [] for task_id in ids}
+    indegree = dict.fromkeys(ids, 0)
+    for precondition_id, task_id in edges:
+        successors[precondition_id].append(task_id)
+        indegree[task_id] += 1
+    queue = deque(task_id for task_id in ids if indegree[task_id] == 0)
+    order = []
+    while queue:
+        task_id = queue.popleft()
+        order.append(task_id)
+        for successor in successors[task_id]:
+            indegree[successor] -= 1
+            if indegree[successor] == 0:
+                queue.append(successor)
+    tasks = [Task(id=task_id, topo_order=position) for task_id, position in zip(order, ids)]
+    Task.objects.bulk_update(tasks, ['topo_order'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='topo_order',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='topological order'),
+        ),
+        migrations.RunPython(fill_topo_order, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', 'topo_order'], name='tasks_task_owner_i_efa92d_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.13 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0002_topo_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='leased_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 1)), fields=['send_time', 'id'], name='tasks_task_pending_due_idx'),
+        ),
+    ]
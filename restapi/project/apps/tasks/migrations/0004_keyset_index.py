@@ -0,0 +1,21 @@
+# Generated by Django 4.2.13 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0003_pending_lease'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='task',
+            name='tasks_task_owner_i_d9f95e_idx',
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', 'send_time', 'id'], name='tasks_task_owner_i_2fb581_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0004_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taskclosure',
+            name='paths',
+            field=models.BigIntegerField(default=1),
+        ),
+    ]
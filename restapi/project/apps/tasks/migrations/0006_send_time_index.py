@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_closure_paths_bigint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['send_time', 'id'], name='tasks_task_send_ti_4033a9_idx'),
+        ),
+    ]
@@ -0,0 +1,343 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy as _
+from logging import getLogger
+
+from project.messages import get_message
+from project.settings import VALUES
+
+logger = getLogger(__name__)
+
+
+class TaskClosureManager(models.Manager):
+    """
+    Keeps the closure table of the precondition graph in step with its edges.
+
+    Each row counts the paths from `ancestor` to `descendant`, so removing one edge only
+    decrements the pairs that were reachable through it and leaves pairs that have another path.
+    Counts grow exponentially with stacked diamonds, so they saturate at `MAX_PATHS`: a
+    saturated row only says "reachable", and removing an edge that one goes through recounts
+    the descendants of the edge instead.
+    """
+    MAX_PATHS = 2 ** 62
+
+    def link(self, precondition_id, task_id):
+        """ account for the new edge precondition -> task in one statement. """
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (ancestor_id, descendant_id, paths) '
+                f'SELECT a.ancestor_id, d.descendant_id, {self.saturated("CAST(a.paths AS NUMERIC) * d.paths")} '
+                f'FROM {table} a, {table} d WHERE a.descendant_id = %s AND d.ancestor_id = %s '
+                f'ON CONFLICT (ancestor_id, descendant_id) DO UPDATE '
+                f'SET paths = {self.saturated(f"CAST({table}.paths AS NUMERIC) + excluded.paths")}',
+                [precondition_id, task_id],
+            )
+
+    def unlink(self, precondition_id, task_id, removed=None):
+        """
+        Drop the paths that went through the edge precondition -> task. `removed` lists every
+        edge already unlinked whose row may still be in the edge table, this one included.
+        """
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT 1 FROM {table} a, {table} d, {table} c WHERE a.descendant_id = %s AND d.ancestor_id = %s '
+                f'AND c.ancestor_id = a.ancestor_id AND c.descendant_id = d.descendant_id AND c.paths >= %s LIMIT 1',
+                [precondition_id, task_id, self.MAX_PATHS],
+            )
+            if cursor.fetchone():
+                self.recount(task_id, removed or [(precondition_id, task_id)])
+                return
+            cursor.execute(
+                f'UPDATE {table} SET paths = {table}.paths - a.paths * d.paths '
+                f'FROM {table} a, {table} d WHERE a.descendant_id = %s AND d.ancestor_id = %s '
+                f'AND {table}.ancestor_id = a.ancestor_id AND {table}.descendant_id = d.descendant_id',
+                [precondition_id, task_id],
+            )
+            cursor.execute(
+                f'DELETE FROM {table} WHERE paths <= 0 '
+                f'AND ancestor_id IN (SELECT ancestor_id FROM {table} WHERE descendant_id = %s)',
+                [precondition_id],
+            )
+
+    def recount(self, task_id, removed):
+        """
+        Count the paths into the task and its descendants again from the edges, in dependency
+        order, leaving out the `removed` (precondition id, task id) edges.
+        """
+        descendants = list(Task.objects.filter(ancestor_links__ancestor_id=task_id).order_by('topo_order')
+                           .values_list('pk', flat=True))
+        preconditions = {descendant_id: [] for descendant_id in descendants}
+        edges = Task.preconditions.through.objects.filter(from_task_id__in=descendants).values_list('to_task_id', 'from_task_id')
+        for edge in edges:
+            if edge not in removed:
+                preconditions[edge[1]].append(edge[0])
+        counted = {}
+        outside = set(precondition_id for sources in preconditions.values() for precondition_id in sources) - preconditions.keys()
+        for descendant_id, ancestor_id, paths in self.filter(descendant_id__in=outside).values_list('descendant_id', 'ancestor_id', 'paths'):
+            counted.setdefault(descendant_id, {})[ancestor_id] = paths
+        rows = []
+        for descendant_id in descendants:
+            counts = {descendant_id: 1}
+            for precondition_id in preconditions[descendant_id]:
+                for ancestor_id, paths in counted.get(precondition_id, {}).items():
+                    counts[ancestor_id] = min(counts.get(ancestor_id, 0) + paths, self.MAX_PATHS)
+            counted[descendant_id] = counts
+            rows.extend((ancestor_id, descendant_id, paths) for ancestor_id, paths in counts.items())
+        self.filter(descendant_id__in=descendants).delete()
+        self.insert_paths(rows)
+
+    def saturated(self, expression):
+        return f'CASE WHEN {expression} > {self.MAX_PATHS} THEN {self.MAX_PATHS} ELSE {expression} END'
+
+    def insert_paths(self, rows, batch_size=1000):
+        """ bulk insert (ancestor id, descendant id, paths) rows as multi-row VALUES, without building models. """
+        table = self.model._meta.db_table
+        rows = iter(rows)
+        with connection.cursor() as cursor:
+            while batch := list(islice(rows, batch_size)):
+                cursor.execute(
+                    f'INSERT INTO {table} (ancestor_id, descendant_id, paths) VALUES '
+                    + ', '.join(['(%s, %s, %s)'] * len(batch)),
+                    [value for row in batch for value in row],
+                )
+
+
+class TaskManager(models.Manager):
+
+    def restore_topological_order(self, precondition_id, task_id):
+        """
+        Repair `topo_order` after the edge precondition -> task was added.
+
+        Only the affected region moves: descendants of the task that are not yet after the
+        precondition, and ancestors of the precondition that are not yet before the task. Their
+        current positions are pooled and handed back ancestors first (Pearce-Kelly), so every
+        other task keeps its place. Removing an edge never invalidates the order.
+        """
+        orders = dict(self.filter(pk__in=[precondition_id, task_id]).values_list('pk', 'topo_order'))
+        lower, upper = orders[task_id], orders[precondition_id]
+        if upper < lower:
+            return 0
+        forward = list(self.filter(ancestor_links__ancestor_id=task_id, topo_order__lte=upper)
+                       .order_by('topo_order').values_list('pk', 'topo_order'))
+        backward = list(self.filter(descendant_links__descendant_id=precondition_id, topo_order__gte=lower)
+                        .order_by('topo_order').values_list('pk', 'topo_order'))
+        region = backward + forward
+        positions = sorted(order for _, order in region)
+        moved = [Task(pk=pk, topo_order=position) for (pk, order), position in zip(region, positions) if order != position]
+        self.bulk_update(moved, ['topo_order'])
+        return len(moved)
+
+    def resolve_preconditions(self, task_ids, current=None):
+        """
+        Split the pending tasks among `task_ids` into those whose preconditions were all sent on
+        time and those that have to be given up, with one closure join for the whole batch.
+
+        A precondition was sent on time if it was sent no later than `TASKS_PRECONDITION_GAP`
+        after its send time. Tasks are decided in send time order and each ancestor is decided
+        once, so a task whose precondition is earlier in the same batch is ready with it, if
+        the batch is sent (at `current`) on time for that precondition, or fails with it.
+        Returns the ready and blocked ids, the ids of their owners, and for each ready task the
+        ready ids in the batch it still has to be sent after.
+        """
+        current = current or now()
+        gap = VALUES['TASKS_PRECONDITION_GAP']
+        rows = (self.filter(pk__in=task_ids, status=Task.PENDING).order_by('send_time', 'pk')
+                .values_list('pk', 'owner_id', 'send_time'))
+        batch, owners, on_time = [], set(), {}
+        for task_id, owner_id, send_time in rows:
+            batch.append(task_id)
+            owners.add(owner_id)
+            on_time[task_id] = current <= send_time + gap
+        ancestry = {task_id: [] for task_id in batch}
+        statuses = {}
+        links = (TaskClosure.objects.filter(descendant_id__in=batch).exclude(ancestor_id=models.F('descendant_id'))
+                 .values_list('descendant_id', 'ancestor_id', 'ancestor__status', 'ancestor__send_time', 'ancestor__sent_at'))
+        for task_id, ancestor_id, status, send_time, sent_at in links:
+            ancestry[task_id].append(ancestor_id)
+            statuses[ancestor_id] = status == Task.DONE and sent_at is not None and sent_at <= send_time + gap
+        verdicts = {}
+        ready, blocked, after = [], [], {}
+        for task_id in batch:
+            sendable = True
+            pending = []
+            for ancestor_id in ancestry[task_id]:
+                verdict = verdicts.get(ancestor_id)
+                if verdict is None:
+                    verdict = verdicts[ancestor_id] = statuses[ancestor_id]
+                if not verdict:
+                    sendable = False
+                    break
+                if ancestor_id in ancestry:
+                    pending.append(ancestor_id)
+            # as a precondition of later tasks in the batch, a ready task counts if it is sent on time.
+            verdicts[task_id] = sendable and on_time[task_id]
+            if sendable:
+                ready.append(task_id)
+                after[task_id] = pending
+            else:
+                blocked.append(task_id)
+        return ready, blocked, owners, after
+
+    def create_plan(self, tasks, preconditions):
+        """
+        Insert a whole new task graph with a constant number of statements.
+
+        `tasks` are unsaved tasks listed in dependency order and `preconditions` holds their
+        (precondition position, task position) edges. Tasks, edges and closure rows are bulk
+        inserted, and every task's order position is its id as for tasks saved one at a time;
+        since the ids are handed out in list order, that order respects the new edges.
+        """
+        self.bulk_create(tasks, batch_size=1000)
+        self.filter(pk__in=[task.pk for task in tasks]).update(topo_order=models.F('pk'))
+        for task in tasks:
+            task.topo_order = task.pk
+            task._remember_schedule()
+
+        Edge = Task.preconditions.through
+        Edge.objects.bulk_create(
+            [Edge(from_task_id=tasks[target].pk, to_task_id=tasks[source].pk) for source, target in preconditions],
+            batch_size=1000,
+        )
+
+        TaskClosure.objects.insert_paths(self.plan_paths(tasks, preconditions))
+        return tasks
+
+    @staticmethod
+    def plan_paths(tasks, preconditions):
+        """
+        Closure rows of a new plan, counted in dependency order and saturating like `link`, as
+        they are made. A task's counts are dropped once its last dependent is counted, so only
+        the tasks that still have dependents to come are held.
+        """
+        sources = [[] for _ in tasks]
+        last_use = list(range(len(tasks)))
+        for source, target in preconditions:
+            sources[target].append(source)
+            last_use[source] = max(last_use[source], target)
+        released = [[] for _ in tasks]
+        for position, last in enumerate(last_use):
+            released[last].append(position)
+        paths = {}
+        for position, task in enumerate(tasks):
+            counts = {task.pk: 1}
+            for source in sources[position]:
+                for ancestor_id, count in paths[source].items():
+                    counts[ancestor_id] = min(counts.get(ancestor_id, 0) + count, TaskClosureManager.MAX_PATHS)
+            paths[position] = counts
+            yield from ((ancestor_id, task.pk, count) for ancestor_id, count in counts.items())
+            for done in released[position]:
+                del paths[done]
+
+
+class Task(models.Model):
+    PENDING = 1
+    DONE = 2
+    NOT_DONE = 3
+    STATUSES = [
+        (PENDING, 'pending'),
+        (DONE, 'done'),
+        (NOT_DONE, 'not done'),
+    ]
+
+    title = models.CharField(_('title'), max_length=128)
+    description = models.TextField(_('description'), blank=True)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tasks')
+    send_time = models.DateTimeField(_('time to send'))
+    preconditions = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='dependents')
+    status = models.SmallIntegerField(choices=STATUSES, default=PENDING)
+    sent_at = models.DateTimeField(_('sent at'), blank=True, null=True)
+    # position in the owner's dependency order; new tasks are appended by taking their own id.
+    topo_order = models.BigIntegerField(_('topological order'), blank=True, null=True, editable=False)
+    leased_until = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = TaskManager()
+
+    # fields whose change has to reach the dispatch queue; preconditions are checked when sending.
+    SCHEDULE_FIELDS = frozenset(['send_time', 'status'])
+
+    class Meta:
+        indexes = [
+            # keyset pages of an owner's tasks are one range scan of this index.
+            models.Index(fields=['owner', 'send_time', 'id']),
+            # the same for listings of every owner's tasks (admins).
+            models.Index(fields=['send_time', 'id']),
+            models.Index(fields=['owner', 'topo_order']),
+            # due-order scan over pending tasks only (status 1 is PENDING), for the database dispatch backend.
+            models.Index(fields=['send_time', 'id'], condition=models.Q(status=1), name='tasks_task_pending_due_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_schedule()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_schedule()
+
+    def _remember_schedule(self):
+        self._loaded_schedule = {name: self.__dict__[name] for name in self.SCHEDULE_FIELDS if name in self.__dict__}
+        # a task moved to another owner changes the versions of both.
+        self._loaded_owner_id = self.__dict__.get('owner_id')
+
+    def changed_schedule_fields(self):
+        """ schedule fields that differ from what was loaded; all of them for a task not loaded from the db. """
+        loaded = getattr(self, '_loaded_schedule', {})
+        return {name for name in self.SCHEDULE_FIELDS if name not in loaded or loaded[name] != getattr(self, name)}
+
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        super(Task, self).save(*args, **kwargs)
+        self._remember_schedule()
+        if created:
+            if self.topo_order is None:
+                self.topo_order = self.pk
+                Task.objects.filter(pk=self.pk).update(topo_order=self.pk)
+            TaskClosure.objects.create(ancestor=self, descendant=self)
+
+    def __str__(self):
+        return self.title
+
+    def ancestors(self):
+        """ every task this one transitively depends on. """
+        return Task.objects.filter(descendant_links__descendant=self).exclude(pk=self.pk)
+
+    def descendants(self):
+        """ every task that transitively depends on this one. """
+        return Task.objects.filter(ancestor_links__ancestor=self).exclude(pk=self.pk)
+
+    def would_create_cycle(self, preconditions):
+        """ adding an edge p -> self closes a cycle exactly when self already reaches p. """
+        if self.pk is None:
+            return False
+        return TaskClosure.objects.filter(ancestor=self, descendant__in=preconditions).exists()
+
+    def clean_preconditions(self, preconditions, owner=None):
+        owner_id = owner.pk if owner is not None else self.owner_id
+        if any(precondition.owner_id != owner_id for precondition in preconditions):
+            raise ValidationError(get_message('precondition_owner', flat=True))
+        if self.would_create_cycle(preconditions):
+            raise ValidationError(get_message('precondition_cycle', flat=True))
+
+
+class TaskClosure(models.Model):
+    ancestor = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='ancestor_links')
+    paths = models.BigIntegerField(default=1)
+
+    objects = TaskClosureManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='tasks_closure_ancestor_descendant'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'ancestor']),
+        ]
@@ -0,0 +1,100 @@
+from logging import getLogger
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from project.apps.tasks.dispatch import get_backend
+from project.apps.tasks.models import Task, TaskClosure
+from project.apps.tasks.versions import bump_task_versions
+from project.metrics import counter_metric
+from project.tools import with_commit
+
+logger = getLogger(__name__)
+
+schedule_operations = counter_metric(
+    'tasks_dispatch_schedule_operations', 'Dispatch queue writes made by task saves and deletes, and saves that needed none.',
+    labelnames=['operation'],
+)
+
+
+def precondition_edges(instance, reverse, pk_set):
+    """ (precondition id, task id) pairs of an m2m change, whichever side it was made from. """
+    if reverse:
+        return [(instance.pk, pk) for pk in pk_set]
+    return [(pk, instance.pk) for pk in pk_set]
+
+
+@receiver(m2m_changed, sender=Task.preconditions.through)
+def update_task_closure(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action == 'pre_add':
+        if reverse:
+            for task in model.objects.filter(pk__in=pk_set):
+                task.clean_preconditions([instance])
+        else:
+            instance.clean_preconditions(model.objects.filter(pk__in=pk_set))
+    elif action == 'post_add':
+        for precondition_id, task_id in precondition_edges(instance, reverse, pk_set):
+            TaskClosure.objects.link(precondition_id, task_id)
+            Task.objects.restore_topological_order(precondition_id, task_id)
+    elif action in ('pre_remove', 'pre_clear'):
+        # remove() reports every pk it was given, linked or not; keep the edges that really go away.
+        related = instance.dependents if reverse else instance.preconditions
+        if action == 'pre_remove':
+            related = related.filter(pk__in=pk_set)
+        instance._removed_precondition_pks = set(related.values_list('pk', flat=True))
+    elif action in ('post_remove', 'post_clear'):
+        for precondition_id, task_id in precondition_edges(instance, reverse, instance._removed_precondition_pks):
+            TaskClosure.objects.unlink(precondition_id, task_id)
+
+
+@receiver(pre_delete, sender=Task)
+def unlink_deleted_task(sender, instance, **kwargs):
+    """ through rows go away by cascade without m2m signals, so their paths are dropped here. """
+    edges = Task.preconditions.through.objects.filter(from_task=instance) | Task.preconditions.through.objects.filter(to_task=instance)
+    removed = []
+    for task_id, precondition_id in edges.values_list('from_task_id', 'to_task_id'):
+        removed.append((precondition_id, task_id))
+        TaskClosure.objects.unlink(precondition_id, task_id, removed)
+
+
+@receiver(post_save, sender=Task)
+@with_commit
+def schedule_task(sender, instance, created=False, **kwargs):
+    """ only a new send time or status touches the queue, and moves the task's entry in place. """
+    if not created and not instance.changed_schedule_fields():
+        schedule_operations.labels(operation='skipped').inc()
+        return
+    try:
+        if instance.status == Task.PENDING:
+            get_backend().schedule(instance.pk, instance.send_time)
+            schedule_operations.labels(operation='scheduled' if created else 'rescheduled').inc()
+        else:
+            get_backend().cancel(instance.pk)
+            schedule_operations.labels(operation='cancelled').inc()
+    except Exception as e:
+        logger.exception(e)
+
+
+@receiver(post_delete, sender=Task)
+@with_commit
+def cancel_task(sender, instance, **kwargs):
+    try:
+        get_backend().cancel(instance.pk)
+        schedule_operations.labels(operation='cancelled').inc()
+    except Exception as e:
+        logger.exception(e)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+@with_commit
+def bump_owner_version(sender, instance, **kwargs):
+    bump_task_versions([instance.owner_id, getattr(instance, '_loaded_owner_id', None)])
+
+
+@receiver(m2m_changed, sender=Task.preconditions.through)
+@with_commit
+def bump_precondition_owner_version(sender, instance, action, **kwargs):
+    """ preconditions are listed with their task and reorder others, all of one owner. """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_task_versions([instance.owner_id])
@@ -0,0 +1,133 @@
+from rest_framework import serializers
+
+from project.apps.profile.models import User
+from project.apps.tasks.graph import TaskGraph, TaskGraphError, parse_send_time
+from project.apps.tasks.models import Task
+from project.messages import get_message
+from project.settings import VALUES
+
+
+class ValidateTasksSerializer(serializers.Serializer):
+    tasks = serializers.ListField(allow_empty=False)
+    explain = serializers.BooleanField(default=False)
+
+    def validate_tasks(self, value):
+        try:
+            return TaskGraph.from_tasks(value)
+        except TaskGraphError as e:
+            raise serializers.ValidationError(str(e))
+
+
+class TaskSerializer(serializers.ModelSerializer):
+    owner = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
+    preconditions = serializers.PrimaryKeyRelatedField(queryset=Task.objects.all(), many=True, required=False)
+
+    class Meta:
+        model = Task
+        fields = ['id', 'title', 'description', 'owner', 'send_time', 'preconditions', 'status', 'sent_at', 'topo_order']
+        read_only_fields = ['status', 'sent_at', 'topo_order']
+
+    def validate(self, attrs):
+        """ only admins choose the owner; preconditions must stay within the owner and acyclic. """
+        user = self.context['request'].user
+        if not user.is_admin or 'owner' not in attrs:
+            attrs['owner'] = self.instance.owner if self.instance else user
+        preconditions = attrs.get('preconditions')
+        if preconditions is None and self.instance and attrs['owner'] != self.instance.owner:
+            preconditions = list(self.instance.preconditions.all())
+        if preconditions is not None:
+            (self.instance or Task()).clean_preconditions(preconditions, owner=attrs['owner'])
+        return attrs
+
+
+class TaskRowSerializer:
+    """
+    Read-only twin of `TaskSerializer` for listings, working on `.values()` rows.
+
+    Only the listed columns are fetched, datetimes go through the same `DateTimeField` (so the
+    `DATETIME_FORMAT` setting applies) and the precondition ids of a whole page come from one
+    query over the through table, with none of the per-instance, per-field serializer machinery.
+    """
+    columns = ['id', 'title', 'description', 'owner_id', 'send_time', 'status', 'sent_at', 'topo_order']
+
+    def __init__(self):
+        to_representation = serializers.DateTimeField().to_representation
+        self.convert_time = lambda value: None if value is None else to_representation(value)
+
+    def values(self, queryset):
+        return queryset.values(*self.columns)
+
+    @staticmethod
+    def precondition_ids(task_ids):
+        preconditions = {task_id: [] for task_id in task_ids}
+        edges = (Task.preconditions.through.objects.filter(from_task_id__in=task_ids)
+                 .order_by('from_task_id', 'to_task_id').values_list('from_task_id', 'to_task_id'))
+        for task_id, precondition_id in edges:
+            preconditions[task_id].append(precondition_id)
+        return preconditions
+
+    def serialize(self, rows):
+        convert_time = self.convert_time
+        preconditions = self.precondition_ids([row['id'] for row in rows])
+        return [
+            {
+                'id': row['id'],
+                'title': row['title'],
+                'description': row['description'],
+                'owner': row['owner_id'],
+                'send_time': convert_time(row['send_time']),
+                'preconditions': preconditions[row['id']],
+                'status': row['status'],
+                'sent_at': convert_time(row['sent_at']),
+                'topo_order': row['topo_order'],
+            }
+            for row in rows
+        ]
+
+
+class SendTimeField(serializers.DateTimeField):
+    """ a send time in any form the validate endpoint takes, epoch seconds included. """
+
+    def to_internal_value(self, value):
+        try:
+            return parse_send_time(value)
+        except TaskGraphError as e:
+            raise serializers.ValidationError(str(e))
+
+
+class BulkTaskSerializer(serializers.ModelSerializer):
+    """ a task of a bulk create; `ref` is the client's temporary id, preconditions are refs too. """
+    ref = serializers.CharField(max_length=64)
+    send_time = SendTimeField()
+    preconditions = serializers.ListField(child=serializers.CharField(max_length=64), required=False, default=list)
+
+    class Meta:
+        model = Task
+        fields = ['ref', 'title', 'description', 'send_time', 'preconditions']
+
+
+class BulkCreateTasksSerializer(serializers.Serializer):
+    owner = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
+    tasks = BulkTaskSerializer(many=True, allow_empty=False, max_length=VALUES['TASKS_BULK_CREATE_MAX_TASKS'])
+
+    def validate_tasks(self, value):
+        refs = set()
+        for task in value:
+            if task['ref'] in refs:
+                raise serializers.ValidationError(get_message('task_ref_repeated', flat=True).format(ref=task['ref']))
+            refs.add(task['ref'])
+        for task in value:
+            for ref in task['preconditions']:
+                if ref not in refs:
+                    raise serializers.ValidationError(get_message('task_ref_unknown', flat=True).format(ref=ref))
+        return value
+
+    def validate(self, attrs):
+        user = self.context['request'].user
+        if not user.is_admin or 'owner' not in attrs:
+            attrs['owner'] = user
+        attrs['graph'] = TaskGraph.from_tasks(
+            {'id': task['ref'], 'send_time': task['send_time'], 'preconditions': task['preconditions']}
+            for task in attrs['tasks']
+        )
+        return attrs
@@ -0,0 +1,940 @@
+import json
+from datetime import timedelta
+from random import Random
+from smtplib import SMTPServerDisconnected
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from unittest.mock import Mock, patch
+from prometheus_client import REGISTRY
+from rest_framework import status
+from rest_framework.fields import DateTimeField
+from rest_framework.test import APITestCase
+
+from project.apps.profile.models import User
+from project.apps.tasks import graph
+from project.apps.tasks.dispatch import get_backend
+from project.apps.tasks.dispatch.database_queue import DatabaseDueQueue
+from project.apps.tasks.dispatch.delivery import EmailDelivery
+from project.apps.tasks.dispatch.dispatcher import Dispatcher, WheelDispatcher
+from project.apps.tasks.dispatch.timing_wheel import TimingWheel
+from project.apps.tasks.models import Task, TaskClosure
+from project.apps.tasks.v1.serializers import TaskRowSerializer, TaskSerializer
+from project.settings import VALUES
+from project.tools import iter_json_array
+
+
+class TasksBaseTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create(first_name='nilva', last_name='man', email='nilva.man@test.com')
+        self.client.force_authenticate(self.user1)
+
+
+class ValidateTasksTest(TasksBaseTest):
+    API_NAME = 'tasks:validate'
+    METHOD = 'POST'
+
+    def post(self, data):
+        return self.client.post(reverse(self.API_NAME), json.dumps(data), content_type='application/json')
+
+    def test_ok(self):
+        # example 1 of readme
+        tasks = [
+            {'id': 1, 'send_time': '2020-05-10 10:30', 'preconditions': []},
+            {'id': 2, 'send_time': '2020-05-06 10:30', 'preconditions': [1, 3]},
+            {'id': 3, 'send_time': '2020-02-10 09:30', 'preconditions': []},
+        ]
+        response1 = self.post({'tasks': tasks})
+        self.assertEqual(response1.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response1.json(), {'valid': False})
+
+        # example 2 of readme
+        tasks = [
+            {'id': 1, 'send_time': '2020-05-10 10:30', 'preconditions': []},
+            {'id': 2, 'send_time': '2020-06-10 12:30', 'preconditions': [1, 3]},
+            {'id': 3, 'send_time': '2020-06-01 12:30', 'preconditions': [1]},
+        ]
+        response2 = self.post({'tasks': tasks})
+        self.assertEqual(response2.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response2.json(), {'valid': True, 'order': [1, 3, 2]})
+
+        # preconditions out of the set are not considered
+        tasks = [
+            {'id': 1, 'send_time': 1589090400.0, 'preconditions': [4]},
+            {'id': 2, 'send_time': '1589090500.5', 'preconditions': [1, 5]},
+        ]
+        response3 = self.post({'tasks': tasks})
+        self.assertEqual(response3.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response3.json(), {'valid': True, 'order': [1, 2]})
+
+    def test_cached_verdict(self):
+        cache.delete_pattern('tasks-validation*')
+        task = Task.objects.create(title='task', owner=self.user1, send_time=now())
+        tasks = [
+            {'id': task.id, 'send_time': '2020-05-10 10:30', 'preconditions': []},
+            {'id': 'draft', 'send_time': '2020-06-10 12:30', 'preconditions': [task.id, 'other']},
+            {'id': 'other', 'send_time': '2020-06-01 12:30', 'preconditions': [task.id]},
+        ]
+        with patch.object(graph, 'explain', wraps=graph.explain) as explain:
+            response1 = self.post({'tasks': tasks, 'explain': True})
+            # same set in another order, with preconditions listed differently
+            reordered = [dict(task, preconditions=task['preconditions'][::-1]) for task in reversed(tasks)]
+            response2 = self.post({'tasks': reordered, 'explain': True})
+            self.assertEqual(explain.call_count, 1)
+            # plain verdicts are not memoized
+            self.post({'tasks': tasks})
+            self.assertEqual(explain.call_count, 1)
+            self.assertDictEqual(response2.json(), response1.json())
+            self.assertTrue(response1.json()['valid'])
+
+            self.post({'tasks': tasks[:2], 'explain': True})
+            self.assertEqual(explain.call_count, 2)
+
+            # the verdict is about the posted set alone, so saving a task of the same id keeps it
+            with self.captureOnCommitCallbacks(execute=True):
+                task.save()
+            self.post({'tasks': tasks, 'explain': True})
+            self.assertEqual(explain.call_count, 2)
+
+    def test_explain(self):
+        tasks = [
+            {'id': 1, 'send_time': 100, 'preconditions': []},
+            {'id': 2, 'send_time': 50, 'preconditions': [1, 3]},
+            {'id': 3, 'send_time': 10, 'preconditions': []},
+            {'id': 4, 'send_time': 400, 'preconditions': [5]},
+            {'id': 5, 'send_time': 500, 'preconditions': [4]},
+            {'id': 6, 'send_time': 600, 'preconditions': [5]},
+        ]
+        response = self.post({'tasks': tasks, 'explain': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()
+        self.assertFalse(result['valid'])
+        self.assertCountEqual(result['violations'], [{'precondition': 1, 'task': 2}, {'precondition': 5, 'task': 4}])
+        self.assertListEqual([sorted(cycle) for cycle in result['cycles']], [[4, 5]])
+        time_field = DateTimeField()
+        self.assertListEqual(result['critical_path'], [
+            {'id': 1, 'send_time': time_field.to_representation(graph.parse_send_time(100)),
+             'earliest_send_time': time_field.to_representation(graph.parse_send_time(100))},
+            {'id': 2, 'send_time': time_field.to_representation(graph.parse_send_time(50)),
+             'earliest_send_time': time_field.to_representation(graph.parse_send_time(101))},
+        ])
+
+        tasks = [{'id': 1, 'send_time': 1}, {'id': 2, 'send_time': 2, 'preconditions': [1]}]
+        response = self.post({'tasks': tasks, 'explain': True})
+        self.assertDictEqual(response.json(), {
+            'valid': True, 'order': [1, 2], 'violations': [], 'cycles': [], 'critical_path': [
+                {'id': 1, 'send_time': time_field.to_representation(graph.parse_send_time(1)),
+                 'earliest_send_time': time_field.to_representation(graph.parse_send_time(1))},
+                {'id': 2, 'send_time': time_field.to_representation(graph.parse_send_time(2)),
+                 'earliest_send_time': time_field.to_representation(graph.parse_send_time(2))},
+            ],
+        })
+
+    def test_bad_request(self):
+        response1 = self.post({})
+        self.assertEqual(response1.status_code, status.HTTP_400_BAD_REQUEST)
+        response2 = self.post({'tasks': [{'id': 1}]})
+        self.assertEqual(response2.status_code, status.HTTP_400_BAD_REQUEST)
+        response3 = self.post({'tasks': [{'id': 1, 'send_time': 'tomorrow'}]})
+        self.assertEqual(response3.status_code, status.HTTP_400_BAD_REQUEST)
+        tasks = [{'id': 1, 'send_time': '2020-05-10 10:30'}, {'id': 1, 'send_time': '2020-05-11 10:30'}]
+        response4 = self.post({'tasks': tasks})
+        self.assertEqual(response4.status_code, status.HTTP_400_BAD_REQUEST)
+        # numbers and strings out of the range of datetime
+        for send_time in [1e20, -1e15, '1e20', '-1e15', 'nan', '2020-13-10 10:30']:
+            response5 = self.post({'tasks': [{'id': 1, 'send_time': send_time}]})
+            self.assertEqual(response5.status_code, status.HTTP_400_BAD_REQUEST, send_time)
+
+    def test_forbidden(self):
+        self.client.force_authenticate(None)
+        response = self.post({'tasks': [{'id': 1, 'send_time': '2020-05-10 10:30'}]})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TaskGraphTest(TasksBaseTest):
+
+    def test_cycle(self):
+        tasks = [
+            {'id': 1, 'send_time': 1, 'preconditions': [3]},
+            {'id': 2, 'send_time': 2, 'preconditions': [1]},
+            {'id': 3, 'send_time': 3, 'preconditions': [2]},
+        ]
+        task_graph = graph.TaskGraph.from_tasks(tasks)
+        self.assertIsNone(graph.topological_order(task_graph))
+        self.assertIsNone(graph.feasible_order(task_graph))
+        self.assertIsNone(graph.validate(task_graph))
+        task_graph = graph.TaskGraph.from_tasks([{'id': 1, 'send_time': 1, 'preconditions': [1]}])
+        self.assertIsNone(graph.validate(task_graph))
+
+    def test_large_chain(self):
+        size = 50000
+        tasks = [{'id': i, 'send_time': i, 'preconditions': [i - 1] if i else []} for i in range(size)]
+        task_graph = graph.TaskGraph.from_tasks(reversed(tasks))
+        self.assertEqual(task_graph.edge_count, size - 1)
+        self.assertListEqual(graph.validate(task_graph), list(range(size)))
+        result = graph.explain(task_graph, gap=VALUES['TASKS_PRECONDITION_GAP'])
+        self.assertEqual(len(result['critical_path']), size)
+        tasks[0]['preconditions'] = [size - 1]
+        result = graph.explain(graph.TaskGraph.from_tasks(tasks), gap=VALUES['TASKS_PRECONDITION_GAP'])
+        self.assertEqual(len(result['cycles'][0]), size)
+        self.assertListEqual(result['critical_path'], [])
+        tasks[0]['preconditions'] = []
+        tasks[-1]['send_time'] = 0
+        self.assertIsNone(graph.validate(graph.TaskGraph.from_tasks(tasks)))
+
+
+class BulkValidateTasksTest(TasksBaseTest):
+    API_NAME = 'tasks:bulk_validate'
+    METHOD = 'POST'
+
+    def post(self, body):
+        response = self.client.post(reverse(self.API_NAME), body, content_type='application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return response, [json.loads(line) for line in lines]
+
+    def test_ok(self):
+        valid = {'id': 'a', 'tasks': [{'id': 1, 'send_time': 1}, {'id': 2, 'send_time': 2, 'preconditions': [1]}]}
+        invalid = {'tasks': [{'id': 1, 'send_time': 2}, {'id': 2, 'send_time': 1, 'preconditions': [1]}]}
+        body = '\n'.join([json.dumps(valid), '', json.dumps(invalid)] * 100) + '\n'
+        response, verdicts = self.post(body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(verdicts), 200)
+        self.assertDictEqual(verdicts[0], {'line': 1, 'id': 'a', 'valid': True, 'order': [1, 2]})
+        self.assertDictEqual(verdicts[1], {'line': 3, 'valid': False})
+        self.assertDictEqual(verdicts[-1], {'line': 300, 'valid': False})
+
+    def test_bad_request(self):
+        long_line = json.dumps({'tasks': [{'id': i, 'send_time': i} for i in range(10)]})
+        body = '\n'.join(['{', '{"tasks": []}', long_line, '{"tasks": [{"id": 1, "send_time": 1}]}'])
+        with patch.dict(VALUES, {'TASKS_BULK_VALIDATE_MAX_LINE_SIZE': 100}):
+            response, verdicts = self.post(body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual([verdict['line'] for verdict in verdicts], [1, 2, 3, 4])
+        self.assertIn('errors', verdicts[0])
+        self.assertIn('errors', verdicts[1])
+        self.assertIn('errors', verdicts[2])
+        self.assertDictEqual(verdicts[3], {'line': 4, 'valid': True, 'order': [1]})
+
+
+class TaskClosureTest(TasksBaseTest):
+
+    def create_tasks(self, count):
+        return [Task.objects.create(title=f'task {i}', owner=self.user1, send_time=now() + timedelta(hours=i)) for i in range(count)]
+
+    def test_closure(self):
+        task1, task2, task3, task4 = self.create_tasks(4)
+        # diamond: 1 -> 2 -> 4 and 1 -> 3 -> 4
+        task2.preconditions.add(task1)
+        task3.preconditions.add(task1)
+        task4.preconditions.add(task2, task3)
+        self.assertCountEqual(task4.ancestors(), [task1, task2, task3])
+        self.assertCountEqual(task1.descendants(), [task2, task3, task4])
+        self.assertEqual(TaskClosure.objects.get(ancestor=task1, descendant=task4).paths, 2)
+        self.assertTrue(task1.would_create_cycle([task4]))
+        self.assertFalse(task4.would_create_cycle([task1]))
+
+        task4.preconditions.remove(task2)
+        self.assertCountEqual(task4.ancestors(), [task1, task3])
+        self.assertEqual(TaskClosure.objects.get(ancestor=task1, descendant=task4).paths, 1)
+        task1.dependents.clear()
+        self.assertCountEqual(task4.ancestors(), [task3])
+        self.assertCountEqual(task1.descendants(), [])
+
+        task3.delete()
+        self.assertCountEqual(task4.ancestors(), [])
+        self.assertEqual(TaskClosure.objects.count(), 3)
+
+    def test_saturated_paths(self):
+        # 64 stacked diamonds: 2 ** 64 paths from the top to the bottom
+        top = bottom = self.create_tasks(1)[0]
+        for i in range(64):
+            left, right, below = self.create_tasks(3)
+            left.preconditions.add(bottom)
+            right.preconditions.add(bottom)
+            below.preconditions.add(left, right)
+            bottom = below
+            if i == 9:
+                tenth = below
+        tail = self.create_tasks(1)[0]
+        tail.preconditions.add(bottom)
+
+        def paths(ancestor, descendant):
+            return TaskClosure.objects.get(ancestor=ancestor, descendant=descendant).paths
+
+        self.assertEqual(paths(top, tenth), 2 ** 10)
+        self.assertEqual(paths(top, tail), TaskClosure.objects.MAX_PATHS)
+        # the only edge into the tail carries all of its saturated paths
+        tail.preconditions.remove(bottom)
+        self.assertCountEqual(tail.ancestors(), [])
+        self.assertEqual(paths(top, bottom), TaskClosure.objects.MAX_PATHS)
+        top.dependents.remove(top.dependents.first())
+        self.assertEqual(paths(top, tenth), 2 ** 9)
+        self.assertEqual(paths(top, bottom), TaskClosure.objects.MAX_PATHS)
+        bottom.delete()
+        self.assertEqual(paths(top, tenth), 2 ** 9)
+
+    def test_cycle(self):
+        task1, task2, task3 = self.create_tasks(3)
+        task2.preconditions.add(task1)
+        task3.preconditions.add(task2)
+        with self.assertRaises(ValidationError), transaction.atomic():
+            task1.preconditions.add(task3)
+        with self.assertRaises(ValidationError), transaction.atomic():
+            task3.dependents.add(task1)
+        with self.assertRaises(ValidationError), transaction.atomic():
+            task1.preconditions.add(task1)
+        self.assertCountEqual(task1.ancestors(), [])
+
+
+class TaskListCreateTest(TasksBaseTest):
+    API_NAME = 'tasks:task_list'
+
+    def setUp(self):
+        super().setUp()
+        self.user2 = User.objects.create(first_name='other', last_name='user', email='other.user@test.com')
+        self.task1 = Task.objects.create(title='task 1', owner=self.user1, send_time=now() + timedelta(hours=1))
+        self.task2 = Task.objects.create(title='task 2', owner=self.user2, send_time=now() + timedelta(hours=2))
+
+    def test_ok(self):
+        data = {'title': 'task 3', 'send_time': (now() + timedelta(hours=3)).isoformat(), 'preconditions': [self.task1.id]}
+        response1 = self.client.post(reverse(self.API_NAME), data, format='json')
+        self.assertEqual(response1.status_code, status.HTTP_201_CREATED)
+        task3 = Task.objects.get(id=response1.json()['id'])
+        self.assertEqual(task3.owner, self.user1)
+        self.assertCountEqual(task3.ancestors(), [self.task1])
+
+        response2 = self.client.get(reverse(self.API_NAME))
+        self.assertEqual(response2.status_code, status.HTTP_200_OK)
+        self.assertListEqual([task['id'] for task in response2.json()['results']], [self.task1.id, task3.id])
+        self.assertListEqual(response2.json()['results'][1]['preconditions'], [self.task1.id])
+
+        self.user1.permission = User.ADMIN_USER
+        self.user1.save()
+        data = {'title': 'task 4', 'owner': self.user2.id, 'send_time': (now() + timedelta(hours=4)).isoformat()}
+        response3 = self.client.post(reverse(self.API_NAME), data, format='json')
+        self.assertEqual(response3.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Task.objects.get(id=response3.json()['id']).owner, self.user2)
+        response4 = self.client.get(reverse(self.API_NAME))
+        self.assertEqual(len(response4.json()['results']), 4)
+
+    def test_pagination(self):
+        send_time = now() + timedelta(days=1)
+        Task.objects.bulk_create([
+            Task(title=f'task {i}', owner=self.user1, send_time=send_time + timedelta(minutes=i // 3)) for i in range(20)
+        ])
+        expected = list(Task.objects.filter(owner=self.user1).order_by('send_time', 'id').values_list('id', flat=True))
+
+        ids, pages, url = [], [], reverse(self.API_NAME) + '?limit=7'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.json())
+            ids.extend(task['id'] for task in response.json()['results'])
+            url = response.json()['next']
+        self.assertListEqual(ids, expected)
+        self.assertListEqual([len(page['results']) for page in pages], [7, 7, 7])
+        # the cursor bounds the index range, not only the OR that breaks ties
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(pages[1]['next'])
+        page_query, = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT "tasks_task"')]
+        self.assertIn('"send_time" >= ', page_query)
+        self.assertIsNone(pages[0]['previous'])
+        self.assertNotIn('total', pages[0])
+
+        # back from the last page
+        response1 = self.client.get(pages[-1]['previous'])
+        self.assertListEqual([task['id'] for task in response1.json()['results']], expected[7:14])
+        response2 = self.client.get(response1.json()['previous'])
+        self.assertListEqual([task['id'] for task in response2.json()['results']], expected[:7])
+        self.assertIsNone(response2.json()['previous'])
+        self.assertEqual(response2.json()['next'].split('cursor=')[1], pages[0]['next'].split('cursor=')[1])
+
+        response3 = self.client.get(reverse(self.API_NAME), {'cursor': 'not a cursor'})
+        self.assertEqual(response3.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_get(self):
+        response1 = self.client.get(reverse(self.API_NAME))
+        etag = response1['ETag']
+        self.assertIn('private', response1['Cache-Control'])
+        with self.assertNumQueries(0):
+            response2 = self.client.get(reverse(self.API_NAME), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response2['ETag'], etag)
+        self.assertEqual(response2['Cache-Control'], response1['Cache-Control'])
+        # another page is another tag
+        self.assertNotEqual(self.client.get(reverse(self.API_NAME), {'limit': 1})['ETag'], etag)
+
+        # other owners' writes leave the tag alone, the user's own change it
+        with self.captureOnCommitCallbacks(execute=True):
+            self.task2.save()
+        self.assertEqual(self.client.get(reverse(self.API_NAME), HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.task1.preconditions.set([])
+            Task.objects.create(title='task 3', owner=self.user1, send_time=now())
+        response3 = self.client.get(reverse(self.API_NAME), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response3.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response3.json()['results']), 2)
+
+    def test_bad_request(self):
+        data = {'title': 'task 3', 'send_time': now().isoformat(), 'preconditions': [self.task2.id]}
+        response1 = self.client.post(reverse(self.API_NAME), data, format='json')
+        self.assertEqual(response1.status_code, status.HTTP_400_BAD_REQUEST)
+        response2 = self.client.post(reverse(self.API_NAME), {'title': 'task 3'}, format='json')
+        self.assertEqual(response2.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TaskExportTest(TasksBaseTest):
+    API_NAME = 'tasks:task_export'
+
+    def test_ok(self):
+        user2 = User.objects.create(first_name='other', last_name='user', email='other.user@test.com')
+        send_time = now() + timedelta(days=1)
+        tasks = Task.objects.bulk_create([
+            Task(title=f'task {i}', owner=self.user1, send_time=send_time + timedelta(minutes=i)) for i in range(25)
+        ])
+        for task in tasks[1:]:
+            Task.preconditions.through.objects.create(from_task=task, to_task=tasks[0])
+        Task.objects.create(title='other', owner=user2, send_time=send_time)
+
+        with patch.dict(VALUES, {'TASKS_EXPORT_CHUNK_SIZE': 10}):
+            response1 = self.client.get(reverse(self.API_NAME))
+            self.assertTrue(response1.streaming)
+            data = json.loads(b''.join(response1.streaming_content))
+        self.assertListEqual([task['id'] for task in data], [task.id for task in tasks])
+        self.assertListEqual(data[3]['preconditions'], [tasks[0].id])
+        self.assertListEqual(data[0]['preconditions'], [])
+        self.assertEqual(data[0]['send_time'], DateTimeField().to_representation(tasks[0].send_time))
+
+        params = {'send_time__gte': (send_time + timedelta(minutes=20)).isoformat()}
+        response2 = self.client.get(reverse(self.API_NAME), params)
+        self.assertEqual(len(json.loads(b''.join(response2.streaming_content))), 5)
+
+        # filters are checked before the stream starts, so a bad one is a 400 and not a broken 200
+        response3 = self.client.get(reverse(self.API_NAME), {'send_time__gte': 'not a time'})
+        self.assertEqual(response3.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response3.streaming)
+
+    def test_row_serializer(self):
+        send_time = now() + timedelta(days=1)
+        task1 = Task.objects.create(title='task 1', description='first', owner=self.user1, send_time=send_time)
+        task2 = Task.objects.create(title='task 2', owner=self.user1, send_time=send_time + timedelta(minutes=1))
+        task3 = Task.objects.create(title='task 3', owner=self.user1, send_time=send_time + timedelta(minutes=2))
+        task3.preconditions.add(task1, task2)
+        Task.objects.filter(pk=task1.pk).update(status=Task.DONE, sent_at=now())
+        queryset = Task.objects.order_by('id')
+        serializer = TaskRowSerializer()
+        with self.assertNumQueries(2):
+            rows = serializer.serialize(list(serializer.values(queryset)))
+        self.assertListEqual(rows, [dict(task) for task in TaskSerializer(queryset, many=True).data])
+
+    def test_iter_json_array(self):
+        rows = [{'id': i, 'title': 'x' * i} for i in range(50)]
+        chunks = list(iter_json_array(iter(rows), buffer_size=100))
+        self.assertGreater(len(chunks), 10)
+        self.assertListEqual(json.loads(''.join(chunks)), rows)
+        self.assertListEqual(list(iter_json_array([])), ['[]'])
+
+
+class TaskDetailTest(TasksBaseTest):
+    API_NAME = 'tasks:task_detail'
+
+    def setUp(self):
+        super().setUp()
+        self.task1 = Task.objects.create(title='task 1', owner=self.user1, send_time=now() + timedelta(hours=1))
+        self.task2 = Task.objects.create(title='task 2', owner=self.user1, send_time=now() + timedelta(hours=2))
+        self.task2.preconditions.add(self.task1)
+
+    def test_ok(self):
+        response1 = self.client.get(reverse(self.API_NAME, args=[self.task2.id]))
+        self.assertEqual(response1.status_code, status.HTTP_200_OK)
+        self.assertListEqual(response1.json()['preconditions'], [self.task1.id])
+        response2 = self.client.patch(reverse(self.API_NAME, args=[self.task2.id]), {'preconditions': []}, format='json')
+        self.assertEqual(response2.status_code, status.HTTP_200_OK)
+        self.assertCountEqual(self.task2.ancestors(), [])
+        response3 = self.client.delete(reverse(self.API_NAME, args=[self.task1.id]))
+        self.assertEqual(response3.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_conditional_get(self):
+        response1 = self.client.get(reverse(self.API_NAME, args=[self.task2.id]))
+        response2 = self.client.get(reverse(self.API_NAME, args=[self.task2.id]), HTTP_IF_NONE_MATCH=response1['ETag'])
+        self.assertEqual(response2.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            response3 = self.client.patch(reverse(self.API_NAME, args=[self.task2.id]), {'title': 'renamed'}, format='json')
+        self.assertNotIn('ETag', response3)
+        response4 = self.client.get(reverse(self.API_NAME, args=[self.task2.id]), HTTP_IF_NONE_MATCH=response1['ETag'])
+        self.assertEqual(response4.status_code, status.HTTP_200_OK)
+        self.assertEqual(response4.json()['title'], 'renamed')
+
+    def test_bad_request(self):
+        response = self.client.patch(reverse(self.API_NAME, args=[self.task1.id]), {'preconditions': [self.task2.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertCountEqual(self.task1.ancestors(), [])
+
+    def test_not_found(self):
+        user2 = User.objects.create(first_name='other', last_name='user', email='other.user@test.com')
+        task3 = Task.objects.create(title='task 3', owner=user2, send_time=now())
+        response = self.client.get(reverse(self.API_NAME, args=[task3.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TopologicalOrderTest(TasksBaseTest):
+
+    def reachability(self, tasks):
+        """ transitive closure recomputed from scratch out of the precondition edges. """
+        successors = {task.pk: [] for task in tasks}
+        for task_id, precondition_id in Task.preconditions.through.objects.values_list('from_task_id', 'to_task_id'):
+            successors[precondition_id].append(task_id)
+        reachable = set()
+        for task in tasks:
+            stack = [task.pk]
+            while stack:
+                node = stack.pop()
+                if (task.pk, node) not in reachable:
+                    reachable.add((task.pk, node))
+                    stack.extend(successors[node])
+        return reachable
+
+    def test_fuzz(self):
+        rand = Random(1400)
+        tasks = [Task.objects.create(title=f'task {i}', owner=self.user1, send_time=now()) for i in range(12)]
+        for _ in range(300):
+            task, precondition = rand.choice(tasks), rand.choice(tasks)
+            if rand.random() < 0.7:
+                creates_cycle = (task.pk, precondition.pk) in self.reachability(tasks)
+                try:
+                    with transaction.atomic():
+                        task.preconditions.add(precondition)
+                    rejected = False
+                except ValidationError:
+                    rejected = True
+                self.assertEqual(rejected, creates_cycle)
+            else:
+                task.preconditions.remove(precondition)
+
+            reachable = self.reachability(tasks)
+            closure = set(TaskClosure.objects.values_list('ancestor_id', 'descendant_id'))
+            self.assertSetEqual(closure, reachable)
+            orders = dict(Task.objects.values_list('pk', 'topo_order'))
+            self.assertEqual(len(set(orders.values())), len(tasks))
+            for ancestor_id, descendant_id in reachable:
+                if ancestor_id != descendant_id:
+                    self.assertLess(orders[ancestor_id], orders[descendant_id])
+
+    def test_affected_region(self):
+        task1, task2, task3, task4, task5 = [Task.objects.create(title='task', owner=self.user1, send_time=now()) for _ in range(5)]
+        # already in order: nothing moves
+        self.assertEqual(Task.objects.restore_topological_order(task1.pk, task2.pk), 0)
+        task4.preconditions.add(task3)
+        task2.preconditions.add(task4)
+        orders = dict(Task.objects.values_list('pk', 'topo_order'))
+        self.assertLess(orders[task3.pk], orders[task4.pk])
+        self.assertLess(orders[task4.pk], orders[task2.pk])
+        self.assertEqual(orders[task1.pk], task1.pk)
+        self.assertEqual(orders[task5.pk], task5.pk)
+
+
+class DispatchBaseTest(TasksBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        values = patch.dict(VALUES, {'TASKS_DISPATCH_BACKEND': 'redis', 'TASKS_DISPATCH_QUEUE_KEY': 'test-tasks-dispatch'})
+        values.start()
+        self.addCleanup(values.stop)
+        get_backend.cache_clear()
+        self.addCleanup(get_backend.cache_clear)
+        self.queue = get_backend()
+        self.addCleanup(lambda: settings.REDIS_CONNECTION.delete(*self.queue.keys))
+
+
+class RedisDueQueueTest(DispatchBaseTest):
+
+    def test_claim(self):
+        current = now()
+        self.queue.schedule(1, current - timedelta(seconds=20))
+        self.queue.schedule_many([(2, current - timedelta(seconds=10)), (3, current + timedelta(hours=1))])
+        self.assertEqual(self.queue.size(), 3)
+        self.assertListEqual([task_id for task_id, _ in self.queue.claim(1)], [1])
+        self.assertListEqual([task_id for task_id, _ in self.queue.claim(10)], [2])
+        self.assertListEqual(self.queue.claim(10), [])
+        self.assertEqual(self.queue.size(), 1)
+
+        # an unacked lease goes back with its original due time
+        self.queue.ack([2])
+        self.assertEqual(self.queue.requeue_expired(), 0)
+        self.queue.lease_seconds = -1
+        self.queue.schedule(4, current - timedelta(seconds=30))
+        self.assertListEqual([task_id for task_id, _ in self.queue.claim(10)], [4])
+        self.assertEqual(self.queue.requeue_expired(), 1)
+        claimed = self.queue.claim(10)
+        self.assertEqual(claimed[0][0], 4)
+        self.assertAlmostEqual(claimed[0][1], (current - timedelta(seconds=30)).timestamp(), places=3)
+        self.queue.cancel(4)
+        self.assertEqual(self.queue.requeue_expired(), 0)
+        self.assertListEqual(self.queue.claim(10), [])
+
+    def test_reschedule_during_lease(self):
+        current = now()
+        self.queue.lease_seconds = -1
+        self.queue.schedule(1, current - timedelta(seconds=10))
+        self.assertListEqual([task_id for task_id, _ in self.queue.claim(10)], [1])
+        # moved while leased: the expired lease does not bring back the old due time
+        self.queue.schedule(1, current + timedelta(hours=1))
+        self.assertEqual(self.queue.requeue_expired(), 1)
+        self.assertEqual(self.queue.size(), 1)
+        self.assertEqual(settings.REDIS_CONNECTION.zscore(self.queue.due_key, 1), (current + timedelta(hours=1)).timestamp())
+        self.assertListEqual(self.queue.claim(10), [])
+
+    def test_schedule_on_save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task1 = Task.objects.create(title='task 1', owner=self.user1, send_time=now() - timedelta(seconds=1))
+            task2 = Task.objects.create(title='task 2', owner=self.user1, send_time=now() - timedelta(seconds=1))
+        self.assertEqual(self.queue.size(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            task2.delete()
+        self.assertEqual(self.queue.size(), 1)
+
+        dispatcher = Dispatcher(self.queue, batch_size=10, poll_interval=0)
+        self.assertEqual(dispatcher.run_once(), 1)
+        task1.refresh_from_db()
+        self.assertEqual(task1.status, Task.DONE)
+        self.assertIsNotNone(task1.sent_at)
+        self.assertEqual(dispatcher.run_once(), 0)
+
+
+class DatabaseDueQueueTest(TasksBaseTest):
+
+    def test_claim(self):
+        current = now()
+        task1 = Task.objects.create(title='task 1', owner=self.user1, send_time=current - timedelta(seconds=20))
+        task2 = Task.objects.create(title='task 2', owner=self.user1, send_time=current - timedelta(seconds=10))
+        Task.objects.create(title='task 3', owner=self.user1, send_time=current + timedelta(hours=1))
+        queue = DatabaseDueQueue(lease_seconds=60)
+        self.assertListEqual([task_id for task_id, _ in queue.claim(1)], [task1.id])
+        self.assertListEqual([task_id for task_id, _ in queue.claim(10)], [task2.id])
+        self.assertListEqual(queue.claim(10), [])
+
+        # acked but still pending (not delivered) or lease ran out: claimable again
+        queue.ack([task1.id])
+        Task.objects.filter(pk=task2.id).update(leased_until=current - timedelta(seconds=1))
+        self.assertListEqual([task_id for task_id, _ in queue.claim(10)], [task1.id, task2.id])
+
+        Task.objects.update(leased_until=None)
+        dispatcher = Dispatcher(queue, batch_size=10, poll_interval=0)
+        self.assertEqual(dispatcher.run_once(), 2)
+        self.assertEqual(queue.size(), 1)
+        self.assertEqual(dispatcher.run_once(), 0)
+
+
+class TimingWheelTest(TasksBaseTest):
+
+    def test_fire_on_tick(self):
+        wheel = TimingWheel(start=0, tick=1, slots=4, levels=2)
+        rng = Random(11)
+        deadlines = {payload: rng.randrange(0, 40) for payload in range(200)}
+        timers = {payload: wheel.add(deadline, payload) for payload, deadline in deadlines.items()}
+        for payload in range(0, 200, 7):
+            wheel.cancel(timers.pop(payload))
+        self.assertEqual(len(wheel), len(timers))
+
+        fired = {}
+        for clock in range(40):
+            next_expiry = wheel.next_expiry()
+            for payload in wheel.advance(clock):
+                fired[payload] = clock
+            if fired and max(fired.values()) == clock:
+                self.assertLessEqual(next_expiry, clock)
+        # past the last level (4 * 4 ticks) timers wait in the overflow set and still fire on time
+        self.assertDictEqual(fired, {payload: deadlines[payload] for payload in timers})
+        self.assertEqual(len(wheel), 0)
+        self.assertIsNone(wheel.next_expiry())
+
+    def test_past_deadline(self):
+        wheel = TimingWheel(start=100, tick=0.5)
+        wheel.add(10, 'late')
+        wheel.add(100.6, 'next')
+        self.assertEqual(wheel.next_expiry(), 100)
+        self.assertListEqual(wheel.advance(100.1), ['late'])
+        self.assertListEqual(wheel.advance(100.4), [])
+        self.assertListEqual(wheel.advance(100.5), ['next'])
+
+
+class WheelDispatcherTest(DispatchBaseTest):
+
+    def test_run_once(self):
+        current = now()
+        with self.captureOnCommitCallbacks(execute=True):
+            task1 = Task.objects.create(title='task 1', owner=self.user1, send_time=current + timedelta(milliseconds=500))
+            task2 = Task.objects.create(title='task 2', owner=self.user1, send_time=current + timedelta(seconds=20))
+            task3 = Task.objects.create(title='task 3', owner=self.user1, send_time=current + timedelta(hours=1))
+        clock = [1000.0]
+        dispatcher = WheelDispatcher(self.queue, batch_size=1, poll_interval=0, horizon=60, refill_interval=5,
+                                     clock=lambda: clock[0])
+
+        # one refill takes everything within the horizon, leased past it
+        self.assertEqual(dispatcher.run_once(), 0)
+        self.assertEqual(len(dispatcher.wheel), 2)
+        self.assertEqual(self.queue.requeue_expired(), 0)
+        self.assertListEqual(self.queue.claim(10), [])
+        self.assertLessEqual(dispatcher.wheel.next_expiry(), 1000.5)
+
+        clock[0] = 1000.6
+        self.assertEqual(dispatcher.run_once(), 1)
+        task1.refresh_from_db()
+        self.assertEqual(task1.status, Task.DONE)
+
+        # moved to a later time after it was claimed: not sent early
+        Task.objects.filter(pk=task2.pk).update(send_time=current + timedelta(minutes=30))
+        clock[0] = 1020.1
+        self.assertEqual(dispatcher.run_once(), 1)
+        task2.refresh_from_db()
+        self.assertEqual(task2.status, Task.PENDING)
+        task3.refresh_from_db()
+        self.assertEqual(task3.status, Task.PENDING)
+
+
+class ResolvePreconditionsTest(TasksBaseTest):
+
+    @patch.dict(VALUES, {'TASKS_PRECONDITION_GAP': timedelta(minutes=5)})
+    def test_deliver(self):
+        current = now()
+
+        def create(title, seconds, *preconditions):
+            task = Task.objects.create(title=title, owner=self.user1, send_time=current + timedelta(seconds=seconds))
+            task.preconditions.add(*preconditions)
+            return task
+
+        sent = create('sent', -60)
+        Task.objects.filter(pk=sent.pk).update(status=Task.DONE, sent_at=current)
+        missed = create('missed', -50)
+        Task.objects.filter(pk=missed.pk).update(status=Task.NOT_DONE)
+        # sent, but more than the gap after its send time
+        late = create('late', -3600)
+        Task.objects.filter(pk=late.pk).update(status=Task.DONE, sent_at=current - timedelta(minutes=30))
+        first = create('first', -40, sent)
+        second = create('second', -30, first)
+        third = create('third', -20, second, sent)
+        blocked = create('blocked', -15, missed)
+        after_blocked = create('after blocked', -10, blocked, first)
+        after_late = create('after late', -10, late)
+        # sent now, too late for its dependent in the same batch
+        overdue = create('overdue', -600)
+        after_overdue = create('after overdue', -5, overdue)
+        waiting = create('waiting', 3600)
+        too_early = create('too early', -5, waiting)
+
+        dispatcher = Dispatcher(DatabaseDueQueue(lease_seconds=60), batch_size=10, poll_interval=0)
+        batch = [too_early, after_blocked, third, blocked, second, first, after_late, overdue, after_overdue]
+        with self.assertNumQueries(4):
+            dispatcher.deliver([task.pk for task in batch])
+        statuses = dict(Task.objects.values_list('pk', 'status'))
+        self.assertDictEqual({task.title: statuses[task.pk] for task in batch}, {
+            'first': Task.DONE, 'second': Task.DONE, 'third': Task.DONE, 'overdue': Task.DONE,
+            'blocked': Task.NOT_DONE, 'after blocked': Task.NOT_DONE, 'too early': Task.NOT_DONE,
+            'after late': Task.NOT_DONE, 'after overdue': Task.NOT_DONE,
+        })
+        self.assertEqual(statuses[waiting.pk], Task.PENDING)
+
+
+class EmailDeliveryTest(TasksBaseTest):
+
+    def test_send(self):
+        delivery = EmailDelivery(pool_size=2, messages_per_send=2)
+        self.addCleanup(delivery.close)
+        tasks = [Task(pk=i, title=f'task {i}', description='body', owner=self.user1) for i in range(9)]
+        with patch('project.apps.tasks.dispatch.delivery.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertListEqual(delivery.send(tasks[:5]), [0, 1, 2, 3, 4])
+            self.assertListEqual(delivery.send(tasks[5:]), [5, 6, 7, 8])
+        # connections are kept open across sends, never more than the pool size
+        self.assertLessEqual(get_connection.call_count, 2)
+        self.assertListEqual(sorted(message.subject for message in mail.outbox), sorted(task.title for task in tasks))
+        self.assertListEqual(mail.outbox[0].to, [self.user1.email])
+
+    def test_deliver(self):
+        current = now()
+        task1 = Task.objects.create(title='task 1', owner=self.user1, send_time=current - timedelta(seconds=2))
+        task2 = Task.objects.create(title='task 2', owner=self.user1, send_time=current - timedelta(seconds=1))
+        delivery = EmailDelivery(pool_size=1, messages_per_send=1)
+        self.addCleanup(delivery.close)
+        dispatcher = Dispatcher(DatabaseDueQueue(lease_seconds=60), batch_size=10, poll_interval=0, delivery=delivery)
+
+        # a failed send leaves the task pending and unacked so its lease brings it back
+        with patch.object(delivery, 'send', return_value=[task1.pk]):
+            self.assertListEqual(dispatcher.deliver([task1.pk, task2.pk]), [task1.pk])
+        task1.refresh_from_db()
+        task2.refresh_from_db()
+        self.assertEqual(task1.status, Task.DONE)
+        self.assertEqual(task2.status, Task.PENDING)
+
+    @patch.dict(VALUES, {'TASKS_PRECONDITION_GAP': timedelta(minutes=5)})
+    def test_send_in_precondition_order(self):
+        current = now()
+        first = Task.objects.create(title='first', owner=self.user1, send_time=current - timedelta(seconds=3))
+        second = Task.objects.create(title='second', owner=self.user1, send_time=current - timedelta(seconds=2))
+        second.preconditions.add(first)
+        other = Task.objects.create(title='other', owner=self.user1, send_time=current - timedelta(seconds=1))
+        delivery = EmailDelivery(pool_size=1, messages_per_send=10)
+        self.addCleanup(delivery.close)
+        dispatcher = Dispatcher(DatabaseDueQueue(lease_seconds=60), batch_size=10, poll_interval=0, delivery=delivery)
+
+        # the precondition fails: its dependent is held with it instead of going out first
+        with patch.object(delivery, 'send', side_effect=lambda tasks: [task.pk for task in tasks if task.pk != first.pk]) as send:
+            self.assertListEqual(dispatcher.deliver([first.pk, second.pk, other.pk]), [other.pk])
+        self.assertListEqual([[task.pk for task in call.args[0]] for call in send.call_args_list], [[first.pk, other.pk]])
+        statuses = dict(Task.objects.values_list('pk', 'status'))
+        self.assertListEqual([statuses[first.pk], statuses[second.pk], statuses[other.pk]], [Task.PENDING, Task.PENDING, Task.DONE])
+
+        # retried: the dependent goes out in the wave after its precondition
+        with patch.object(delivery, 'send', side_effect=lambda tasks: [task.pk for task in tasks]) as send:
+            self.assertListEqual(dispatcher.deliver([first.pk, second.pk]), [first.pk, second.pk])
+        self.assertListEqual([[task.pk for task in call.args[0]] for call in send.call_args_list], [[first.pk], [second.pk]])
+
+    def test_partial_run(self):
+        delivery = EmailDelivery(pool_size=1, messages_per_send=3)
+        self.addCleanup(delivery.close)
+        tasks = [Task(pk=i, title=f'task {i}', description='body', owner=self.user1) for i in range(3)]
+        connection = mail.get_connection()
+        # the run's connection drops after two messages: those two are reported sent and not sent again
+        with patch.object(connection, 'send_messages', side_effect=[1, 1, SMTPServerDisconnected('gone')]), \
+                patch('project.apps.tasks.dispatch.delivery.get_connection', return_value=connection):
+            self.assertListEqual(delivery.send(tasks), [0, 1])
+
+    def test_stale_connection(self):
+        delivery = EmailDelivery(pool_size=1, messages_per_send=3)
+        self.addCleanup(delivery.close)
+        tasks = [Task(pk=i, title=f'task {i}', description='body', owner=self.user1) for i in range(2)]
+        stale, fresh = mail.get_connection(), mail.get_connection()
+        # the server dropped the idle connection: its NOOP fails and a fresh one takes the run
+        stale.connection = Mock(**{'noop.side_effect': SMTPServerDisconnected('gone')})
+        delivery.pool.idle.put(stale)
+        with patch.object(stale, 'close') as close, \
+                patch('project.apps.tasks.dispatch.delivery.get_connection', return_value=fresh):
+            self.assertListEqual(delivery.send(tasks), [0, 1])
+        close.assert_called_once()
+        self.assertIs(delivery.pool.idle.get_nowait(), fresh)
+
+        # one that answers is reused as is
+        fresh.connection = Mock(**{'noop.return_value': (250, b'OK')})
+        delivery.pool.idle.put(fresh)
+        with patch('project.apps.tasks.dispatch.delivery.get_connection') as get_connection:
+            self.assertListEqual(delivery.send(tasks), [0, 1])
+        get_connection.assert_not_called()
+
+
+class RescheduleTest(DispatchBaseTest):
+
+    @staticmethod
+    def operations(operation):
+        return REGISTRY.get_sample_value('pishkhan_restapi_tasks_dispatch_schedule_operations_total', {'operation': operation}) or 0
+
+    def test_reschedule_on_change(self):
+        send_time = now() + timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            task = Task.objects.create(title='task', owner=self.user1, send_time=send_time)
+        self.assertEqual(self.queue.size(), 1)
+
+        skipped, rescheduled = self.operations('skipped'), self.operations('rescheduled')
+        task = Task.objects.get(pk=task.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            task.title = 'renamed'
+            task.save()
+            task.description = 'described'
+            task.save()
+        self.assertEqual(self.operations('skipped'), skipped + 2)
+        self.assertEqual(self.operations('rescheduled'), rescheduled)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            task.send_time = send_time + timedelta(hours=1)
+            task.save()
+            task.title = 'renamed again'
+            task.save()
+        self.assertEqual(self.operations('rescheduled'), rescheduled + 1)
+        self.assertEqual(self.queue.size(), 1)
+        self.assertEqual(settings.REDIS_CONNECTION.zscore(self.queue.due_key, task.pk), task.send_time.timestamp())
+
+        cancelled = self.operations('cancelled')
+        with self.captureOnCommitCallbacks(execute=True):
+            task.status = Task.NOT_DONE
+            task.save(update_fields=['status'])
+        self.assertEqual(self.operations('cancelled'), cancelled + 1)
+        self.assertEqual(self.queue.size(), 0)
+
+
+class BulkCreateTasksTest(DispatchBaseTest):
+    API_NAME = 'tasks:bulk_create'
+
+    def plan(self, *tasks):
+        start = now() + timedelta(hours=1)
+        return {'tasks': [
+            {'ref': ref, 'title': f'task {ref}', 'send_time': (start + timedelta(minutes=minutes)).isoformat(),
+             'preconditions': preconditions}
+            for ref, minutes, preconditions in tasks
+        ]}
+
+    def test_ok(self):
+        data = self.plan(('d', 30, ['b', 'c']), ('b', 10, ['a']), ('c', 20, ['a']), ('a', 0, []), ('e', 5, []))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse(self.API_NAME), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = {task['ref']: task['id'] for task in response.json()['tasks']}
+        self.assertListEqual(list(ids), ['d', 'b', 'c', 'a', 'e'])
+        tasks = {ref: Task.objects.get(pk=task_id) for ref, task_id in ids.items()}
+        self.assertTrue(all(task.owner == self.user1 for task in tasks.values()))
+        self.assertCountEqual(tasks['d'].preconditions.all(), [tasks['b'], tasks['c']])
+        self.assertCountEqual(tasks['d'].ancestors(), [tasks['a'], tasks['b'], tasks['c']])
+        self.assertEqual(TaskClosure.objects.get(ancestor=tasks['a'], descendant=tasks['d']).paths, 2)
+        self.assertLess(tasks['a'].topo_order, tasks['b'].topo_order)
+        self.assertLess(tasks['c'].topo_order, tasks['d'].topo_order)
+        self.assertEqual(self.queue.size(), 5)
+
+        # the closure keeps up with later edits of the created plan
+        tasks['e'].preconditions.add(tasks['d'])
+        self.assertCountEqual(tasks['e'].ancestors(), [tasks['a'], tasks['b'], tasks['c'], tasks['d']])
+        tasks['d'].preconditions.remove(tasks['b'])
+        self.assertEqual(TaskClosure.objects.get(ancestor=tasks['a'], descendant=tasks['e']).paths, 1)
+
+    def test_stacked_diamonds(self):
+        # 64 diamonds: the path count from the top to the bottom saturates
+        tasks = [('n0', 0, [])]
+        for i in range(64):
+            tasks += [(f'l{i}', 3 * i + 1, [f'n{i}']), (f'r{i}', 3 * i + 1, [f'n{i}']), (f'n{i + 1}', 3 * i + 2, [f'l{i}', f'r{i}'])]
+        response = self.client.post(reverse(self.API_NAME), self.plan(*tasks), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = {task['ref']: task['id'] for task in response.json()['tasks']}
+        paths = dict(TaskClosure.objects.filter(ancestor_id=ids['n0']).values_list('descendant_id', 'paths'))
+        self.assertEqual(paths[ids['n10']], 2 ** 10)
+        self.assertEqual(paths[ids['n64']], TaskClosure.objects.MAX_PATHS)
+        self.assertEqual(len(paths), len(tasks))
+
+    def test_bad_request(self):
+        response1 = self.client.post(reverse(self.API_NAME), self.plan(('a', 10, ['b']), ('b', 0, ['a'])), format='json')
+        self.assertEqual(response1.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response1.json()['valid'])
+        self.assertEqual(len(response1.json()['cycles']), 1)
+        response2 = self.client.post(reverse(self.API_NAME), self.plan(('a', 0, []), ('b', 10, ['c'])), format='json')
+        self.assertEqual(response2.status_code, status.HTTP_400_BAD_REQUEST)
+        response3 = self.client.post(reverse(self.API_NAME), self.plan(('a', 0, []), ('a', 10, [])), format='json')
+        self.assertEqual(response3.status_code, status.HTTP_400_BAD_REQUEST)
+        data = self.plan(('a', 0, []))
+        data['tasks'][0]['send_time'] = 1e20
+        response4 = self.client.post(reverse(self.API_NAME), data, format='json')
+        self.assertEqual(response4.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Task.objects.exists())
+
+    def test_epoch_send_time(self):
+        # send times are taken in the forms the validate endpoint takes
+        send_time = (now() + timedelta(hours=1)).replace(microsecond=0)
+        data = self.plan(('a', 0, []), ('b', 0, ['a']))
+        data['tasks'][0]['send_time'] = send_time.timestamp()
+        data['tasks'][1]['send_time'] = str(send_time.timestamp() + 60)
+        response = self.client.post(reverse(self.API_NAME), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = {task['ref']: task['id'] for task in response.json()['tasks']}
+        self.assertEqual(Task.objects.get(pk=ids['a']).send_time, send_time)
+        self.assertEqual(Task.objects.get(pk=ids['b']).send_time, send_time + timedelta(minutes=1))
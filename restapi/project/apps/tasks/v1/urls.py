@@ -4,5 +4,10 @@ from project.apps.tasks.v1 import views
 app_name = 'tasks'
 
 urlpatterns = [
-
+    path('', views.TaskListCreateView.as_view(), name='task_list'),
+    path('<int:pk>/', views.TaskDetailView.as_view(), name='task_detail'),
+    path('export/', views.TaskExportView.as_view(), name='task_export'),
+    path('validate/', views.ValidateTasksView.as_view(), name='validate'),
+    path('bulk-create/', views.BulkCreateTasksView.as_view(), name='bulk_create'),
+    path('bulk-validate/', views.BulkValidateTasksView.as_view(), name='bulk_validate'),
 ]
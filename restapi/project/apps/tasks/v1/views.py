@@ -0,0 +1,244 @@
+import json
+from hashlib import sha1
+from itertools import islice
+from logging import getLogger
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import generics, serializers, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+
+from project.apps.tasks import graph
+from project.apps.tasks.dispatch import get_backend
+from project.apps.tasks.models import Task
+from project.apps.tasks.signals import schedule_operations
+from project.apps.tasks.verdicts import cached_validation
+from project.apps.tasks.versions import ALL_OWNERS, bump_task_versions, task_version
+from project.pagination import KeysetPagination
+from project.settings import VALUES
+from project.tools import iter_json_array, iter_lines
+from .serializers import BulkCreateTasksSerializer, TaskRowSerializer, TaskSerializer, ValidateTasksSerializer
+
+logger = getLogger(__name__)
+
+
+def validation_result(task_graph, explain=False):
+    return cached_validation(task_graph, explain, compute_validation_result)
+
+
+def compute_validation_result(task_graph, explain=False):
+    order = graph.validate(task_graph)
+    data = {'valid': order is not None}
+    if order is not None:
+        data['order'] = order
+    if explain:
+        data |= explanation(task_graph)
+    return data
+
+
+def explanation(task_graph):
+    result = graph.explain(task_graph, gap=VALUES['TASKS_PRECONDITION_GAP'])
+    time_field = serializers.DateTimeField()
+    return {
+        'violations': [{'precondition': source, 'task': target} for source, target in result['violations']],
+        'cycles': result['cycles'],
+        'critical_path': [
+            {
+                'id': task_id,
+                'send_time': time_field.to_representation(send_time),
+                'earliest_send_time': time_field.to_representation(earliest_send_time),
+            }
+            for task_id, send_time, earliest_send_time in result['critical_path']
+        ],
+    }
+
+
+class ValidateTasksView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = ValidateTasksSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = validation_result(serializer.validated_data['tasks'], explain=serializer.validated_data['explain'])
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class BulkValidateTasksView(APIView):
+    """
+    Validate many task sets in one call.
+
+    The body is newline-delimited json, one {"tasks": [...]} object per line. Lines are read and
+    validated one at a time while the response is streamed, one verdict line per input line.
+    """
+    permission_classes = [IsAuthenticated]
+    content_type = 'application/x-ndjson'
+
+    def post(self, request):
+        return StreamingHttpResponse(self.verdicts(request), content_type=self.content_type)
+
+    def verdicts(self, request):
+        max_line_size = VALUES['TASKS_BULK_VALIDATE_MAX_LINE_SIZE']
+        for number, line in enumerate(iter_lines(request, max_line_size), start=1):
+            if line is not None and not line.strip():
+                continue
+            yield json.dumps(self.verdict(number, line)) + '\n'
+
+    @staticmethod
+    def verdict(number, line):
+        result = {'line': number}
+        if line is None:
+            return result | {'errors': f'Line is longer than {VALUES["TASKS_BULK_VALIDATE_MAX_LINE_SIZE"]} bytes.'}
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return result | {'errors': 'Invalid json.'}
+        if isinstance(data, dict) and 'id' in data:
+            result['id'] = data['id']
+        serializer = ValidateTasksSerializer(data=data)
+        if not serializer.is_valid():
+            return result | {'errors': serializer.errors}
+        return result | validation_result(serializer.validated_data['tasks'], explain=serializer.validated_data['explain'])
+
+
+class TaskQuerysetMixin:
+    """ admins manage every task, normal users only their own. """
+    permission_classes = [IsAuthenticated]
+    serializer_class = TaskSerializer
+
+    def get_owned_queryset(self):
+        if self.request.user.is_admin:
+            return Task.objects.all()
+        return Task.objects.filter(owner=self.request.user)
+
+    def get_queryset(self):
+        return self.get_owned_queryset().prefetch_related(Prefetch('preconditions', queryset=Task.objects.only('id')))
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+
+class TaskVersionMixin:
+    """
+    Conditional reads: GET responses carry an ETag made from the version of the tasks the user
+    can see, and a request whose If-None-Match has it gets a 304 before any query or serializer
+    runs. Without a version (redis unavailable) responses are served untagged.
+    """
+
+    def get_etag(self, request):
+        owner_id = ALL_OWNERS if request.user.is_admin else request.user.pk
+        version = task_version(owner_id)
+        if version is None:
+            return None
+        tag = f'{owner_id}:{version}:{request.accepted_media_type}:{request.get_full_path()}'
+        return quote_etag(sha1(tag.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is not None and etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+        if etag is not None and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+        return response
+
+
+class TaskFilterMixin:
+    """ listings read plain rows through `TaskRowSerializer` rather than model instances. """
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {'send_time': ['gte', 'lte'], 'status': ['exact']}
+    row_serializer = TaskRowSerializer()
+
+    def get_rows(self):
+        return self.row_serializer.values(self.filter_queryset(self.get_owned_queryset()))
+
+
+class TaskListCreateView(TaskVersionMixin, TaskQuerysetMixin, TaskFilterMixin, generics.ListCreateAPIView):
+    pagination_class = KeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_rows())
+        return self.get_paginated_response(self.row_serializer.serialize(page))
+
+
+class TaskExportView(TaskVersionMixin, TaskQuerysetMixin, TaskFilterMixin, generics.ListAPIView):
+    """
+    Every matching task as one json array, without pagination.
+
+    Rows are read through a server-side cursor `TASKS_EXPORT_CHUNK_SIZE` at a time (with one
+    precondition query per chunk) and written out as they are serialized, so memory stays flat
+    however many tasks there are.
+    """
+
+    def list(self, request, *args, **kwargs):
+        # filters are checked here, so a bad one is a 400 rather than an error halfway through the stream.
+        rows = self.get_rows()
+        return StreamingHttpResponse(iter_json_array(self.iter_tasks(rows), encoder=JSONEncoder), content_type='application/json')
+
+    def iter_tasks(self, rows):
+        chunk_size = VALUES['TASKS_EXPORT_CHUNK_SIZE']
+        rows = rows.order_by('send_time', 'id').iterator(chunk_size=chunk_size)
+        while chunk := list(islice(rows, chunk_size)):
+            yield from self.row_serializer.serialize(chunk)
+
+
+class TaskDetailView(TaskVersionMixin, TaskQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    pass
+
+
+class BulkCreateTasksView(APIView):
+    """
+    Create a whole plan of tasks in one transaction.
+
+    Tasks carry temporary `ref`s that their preconditions point to. The combined graph is
+    validated once, the tasks, their preconditions and closure rows are bulk inserted and all
+    of them are scheduled with a single queue call after commit. An infeasible plan is rejected
+    with the same explanation the validate endpoint gives.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkCreateTasksSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        task_graph = serializer.validated_data['graph']
+        order = graph.feasible_order(task_graph)
+        if order is None:
+            return Response({'valid': False} | explanation(task_graph), status=status.HTTP_400_BAD_REQUEST)
+
+        owner = serializer.validated_data['owner']
+        entries = serializer.validated_data['tasks']
+        position = {node: index for index, node in enumerate(order)}
+        tasks = [
+            Task(owner=owner, title=entries[node]['title'], description=entries[node].get('description', ''),
+                 send_time=entries[node]['send_time'])
+            for node in order
+        ]
+        preconditions = [(position[source], position[target]) for source, target in task_graph.edges()]
+        with transaction.atomic():
+            Task.objects.create_plan(tasks, preconditions)
+            transaction.on_commit(lambda: self.schedule(tasks))
+            transaction.on_commit(lambda: bump_task_versions([owner.pk]))
+
+        refs = [entries[node]['ref'] for node in order]
+        ids = dict(zip(refs, (task.pk for task in tasks)))
+        data = {'tasks': [{'ref': entry['ref'], 'id': ids[entry['ref']]} for entry in entries]}
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def schedule(tasks):
+        try:
+            get_backend().schedule_many((task.pk, task.send_time) for task in tasks)
+            schedule_operations.labels(operation='scheduled').inc(len(tasks))
+        except Exception as e:
+            logger.exception(e)
@@ -0,0 +1,28 @@
+"""
+Memoized validation verdicts.
+
+Only explained verdicts are memoized: a plain verdict is one O(V+E) pass over the graph and is
+cheaper to recompute than the fingerprint (which has to sort the set) is to build. An
+explained verdict is cached under the fingerprint of its task set, so the same set sent again
+in any order is answered from the cache. A verdict depends on nothing but the posted set (and
+the gap), which the key names, so it is never invalidated, only left to its TTL.
+"""
+from django.core.cache import cache
+
+from project.settings import VALUES
+
+VERDICT_KEY = 'tasks-validation:{fingerprint}:{gap}'
+
+
+def cached_validation(task_graph, explain, validate):
+    """ the verdict of `validate(task_graph, explain)`, computed once per task set and TTL when explained. """
+    if not explain:
+        return validate(task_graph, explain)
+    # explanations depend on the precondition gap as well.
+    key = VERDICT_KEY.format(fingerprint=task_graph.fingerprint(), gap=VALUES['TASKS_PRECONDITION_GAP'].total_seconds())
+    result = cache.get(key)
+    if result is None:
+        result = validate(task_graph, explain)
+        cache.set(key, result, VALUES['TASKS_VALIDATION_CACHE_TTL'])
+    return result
+
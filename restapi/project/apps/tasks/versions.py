@@ -0,0 +1,48 @@
+"""
+Per-owner task versions for conditional reads.
+
+Every owner has a counter in redis that goes up after any committed write to their tasks, and
+`ALL_OWNERS` has one that goes up with every owner's (admins read everyone's tasks). A read
+takes the version before it queries, so a response is never tagged with a version newer than
+its data. A missing counter (new owner, flushed redis) starts at the current time in
+nanoseconds rather than at zero, so it never repeats a version handed out before.
+"""
+import time
+from logging import getLogger
+
+from django.conf import settings
+
+logger = getLogger(__name__)
+
+VERSION_KEY = 'tasks-version:{owner_id}'
+ALL_OWNERS = '*'
+
+
+def task_version(owner_id):
+    """ the current version of an owner's tasks (`ALL_OWNERS` for everyone's), None if redis is unavailable. """
+    key = VERSION_KEY.format(owner_id=owner_id)
+    try:
+        version = settings.REDIS_CONNECTION.get(key)
+        if version is None:
+            pipeline = settings.REDIS_CONNECTION.pipeline(transaction=False)
+            pipeline.set(key, time.time_ns(), nx=True)
+            pipeline.get(key)
+            _, version = pipeline.execute()
+        return int(version)
+    except Exception as e:
+        logger.exception(e)
+        return None
+
+
+def bump_task_versions(owner_ids):
+    """ move on the versions of these owners and of `ALL_OWNERS`. """
+    keys = [VERSION_KEY.format(owner_id=owner_id) for owner_id in {*owner_ids, ALL_OWNERS} if owner_id is not None]
+    try:
+        pipeline = settings.REDIS_CONNECTION.pipeline(transaction=False)
+        start = time.time_ns()
+        for key in keys:
+            pipeline.set(key, start, nx=True)
+            pipeline.incr(key)
+        pipeline.execute()
+    except Exception as e:
+        logger.exception(e)
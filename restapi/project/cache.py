@@ -0,0 +1,274 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from logging import getLogger
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+
+from project.metrics import counter_metric
+
+logger = getLogger(__name__)
+
+local_cache_events = counter_metric(
+    'cache_local_events', 'Hits, misses, evictions and invalidations of the in-process cache tier.', labelnames=['event'],
+)
+
+# "forget everything": sent for writes that touch unknown keys (clear, delete_pattern, incr_version).
+ALL_KEYS = '*'
+
+
+class LocalTier:
+    """
+    The in-process tier of one cache: a bounded LRU of pickled values and the one thread
+    subscribed to its invalidations. Django hands out a cache backend per thread (per greenlet
+    under gevent), so every `TwoTierRedisCache` of a location in the process shares its tier,
+    and its redis client, through `local_tier`.
+    """
+
+    def __init__(self, client, channel, max_entries, timeout):
+        self.client = client
+        self.channel = channel
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.origin = uuid.uuid4().hex
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.subscriber = None
+        self.subscribed = threading.Event()
+        # bumped by every invalidation, so a read that raced one does not fill the local tier.
+        self.generation = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, value, generation, timeout=None):
+        """ keep a value read from redis; `timeout` is what is left of its redis ttl, None for none. """
+        timeout = self.timeout if timeout is None else min(self.timeout, timeout)
+        entry = (time.monotonic() + timeout, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        evicted = 0
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            local_cache_events.labels(event='eviction').inc(evicted)
+
+    def forget(self, keys):
+        with self.lock:
+            self.generation += 1
+            if ALL_KEYS in keys:
+                self.entries.clear()
+            else:
+                for key in keys:
+                    self.entries.pop(key, None)
+
+    def invalidate(self, keys):
+        """ drop keys here and in every other worker. """
+        self.forget(keys)
+        try:
+            self.client.get_client(write=True).publish(self.channel, '\n'.join([self.origin, *keys]))
+        except Exception as e:
+            logger.exception(e)
+
+    def ensure_subscriber(self):
+        if self.subscriber is None:
+            with self.lock:
+                if self.subscriber is None:
+                    self.subscriber = threading.Thread(target=self.listen, name='cache-invalidation', daemon=True)
+                    self.subscriber.start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.get_client(write=False).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # anything published while not subscribed is lost
+                self.forget([ALL_KEYS])
+                self.subscribed.set()
+                for message in pubsub.listen():
+                    origin, *keys = message['data'].decode().split('\n')
+                    if origin != self.origin:
+                        self.forget(keys)
+                        local_cache_events.labels(event='invalidation').inc(len(keys))
+            except Exception as e:
+                logger.exception(e)
+                self.subscribed.clear()
+                self.forget([ALL_KEYS])
+                time.sleep(1)
+
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+_tiers_pid = None
+
+
+def local_tier(backend):
+    """ the process's tier for the backend's location and channel, made on first use. """
+    global _tiers_pid
+    with _tiers_lock:
+        # a forked worker inherits the tiers but not their subscriber threads.
+        if _tiers_pid != os.getpid():
+            _tiers.clear()
+            _tiers_pid = os.getpid()
+        options = backend._params.get('OPTIONS', {})
+        channel = options.get('INVALIDATION_CHANNEL', f'{backend.key_prefix}:cache-invalidation')
+        key = (str(backend._server), channel)
+        if key not in _tiers:
+            _tiers[key] = LocalTier(
+                backend._client_cls(backend._server, backend._params, backend), channel,
+                max_entries=int(options.get('MAX_ENTRIES', 1000)), timeout=float(options.get('LOCAL_TIMEOUT', 60)),
+            )
+        return _tiers[key]
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    django_redis with a bounded in-process LRU in front of it.
+
+    Reads are served from the local tier when possible and fill it on a miss. Every write goes to
+    redis first, then drops the key locally and publishes it on `INVALIDATION_CHANNEL`, where the
+    subscriber thread of every worker drops it too. Local copies also expire after
+    `LOCAL_TIMEOUT` seconds, or with their key in redis if that is sooner, which bounds staleness
+    if an invalidation is lost; the local tier is emptied whenever the subscription has to
+    reconnect for the same reason.
+
+    Values are kept pickled, so callers never share (and mutate) one cached object. Options:
+    `MAX_ENTRIES` (local entries per worker process), `LOCAL_TIMEOUT` and `INVALIDATION_CHANNEL`.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        self._tier = local_tier(self)
+
+    @property
+    def client(self):
+        return self._tier.client
+
+    # reads
+
+    def get(self, key, default=None, version=None, client=None):
+        self._tier.ensure_subscriber()
+        local_key = self.make_key(key, version=version)
+        entry = self._tier.get(local_key)
+        if entry is not None:
+            local_cache_events.labels(event='hit').inc()
+            return pickle.loads(entry[1])
+        local_cache_events.labels(event='miss').inc()
+        generation = self._tier.generation
+        missing = object()
+        value = super().get(key, default=missing, version=version, client=client)
+        if value is missing:
+            return default
+        for timeout in self._ttls([key], version):
+            self._tier.set(local_key, value, generation, timeout)
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        self._tier.ensure_subscriber()
+        found, remote = {}, []
+        for key in keys:
+            entry = self._tier.get(self.make_key(key, version=version))
+            if entry is None:
+                remote.append(key)
+            else:
+                found[key] = pickle.loads(entry[1])
+        local_cache_events.labels(event='hit').inc(len(found))
+        if remote:
+            local_cache_events.labels(event='miss').inc(len(remote))
+            generation = self._tier.generation
+            fetched = super().get_many(remote, version=version, client=client)
+            for (key, value), timeout in zip(fetched.items(), self._ttls(fetched, version)):
+                self._tier.set(self.make_key(key, version=version), value, generation, timeout)
+            found |= fetched
+        return found
+
+    def _ttls(self, keys, version):
+        """
+        Seconds left of each key's redis ttl (None where it has none), in one round trip, so a
+        local copy never outlives its key. Nothing, and so nothing kept locally, if it fails.
+        """
+        try:
+            pipeline = self.client.get_client(write=False).pipeline(transaction=False)
+            for key in keys:
+                pipeline.pttl(self.client.make_key(key, version=version))
+            # -1: no ttl; -2: gone since it was read, kept for no time.
+            return [None if ttl == -1 else max(ttl, 0) / 1000 for ttl in pipeline.execute()]
+        except Exception as e:
+            logger.exception(e)
+            return []
+
+    # writes
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, *args, **kwargs):
+        result = super().set(key, value, timeout, version, *args, **kwargs)
+        self._tier.invalidate([self.make_key(key, version=version)])
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, *args, **kwargs):
+        result = super().add(key, value, timeout, version, *args, **kwargs)
+        if result:
+            self._tier.invalidate([self.make_key(key, version=version)])
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, *args, **kwargs):
+        result = super().set_many(data, timeout, version, *args, **kwargs)
+        self._tier.invalidate([self.make_key(key, version=version) for key in data])
+        return result
+
+    def delete(self, key, version=None, *args, **kwargs):
+        result = super().delete(key, version, *args, **kwargs)
+        self._tier.invalidate([self.make_key(key, version=version)])
+        return result
+
+    def delete_many(self, keys, version=None, *args, **kwargs):
+        keys = list(keys)
+        result = super().delete_many(keys, version, *args, **kwargs)
+        self._tier.invalidate([self.make_key(key, version=version) for key in keys])
+        return result
+
+    def incr(self, key, delta=1, version=None, *args, **kwargs):
+        result = super().incr(key, delta, version, *args, **kwargs)
+        self._tier.invalidate([self.make_key(key, version=version)])
+        return result
+
+    def decr(self, key, delta=1, version=None, *args, **kwargs):
+        result = super().decr(key, delta, version, *args, **kwargs)
+        self._tier.invalidate([self.make_key(key, version=version)])
+        return result
+
+    def expire(self, key, timeout, version=None, *args, **kwargs):
+        result = super().expire(key, timeout, version, *args, **kwargs)
+        self._tier.invalidate([self.make_key(key, version=version)])
+        return result
+
+    def delete_pattern(self, *args, **kwargs):
+        result = super().delete_pattern(*args, **kwargs)
+        self._tier.invalidate([ALL_KEYS])
+        return result
+
+    def incr_version(self, *args, **kwargs):
+        result = super().incr_version(*args, **kwargs)
+        self._tier.invalidate([ALL_KEYS])
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._tier.invalidate([ALL_KEYS])
+        return result
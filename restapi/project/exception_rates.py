@@ -0,0 +1,58 @@
+"""
+Windowed exception counts.
+
+Every second has one redis hash, `{EXCEPTION_METRICS_PREFIX}:{second}`, whose fields are
+"route<TAB>exception class" counters. Recording an exception is one atomic HINCRBY and EXPIRE,
+so an error storm adds counts to at most one key per second, and buckets expire on their own
+`EXCEPTION_METRICS_TTL` seconds (the window) later. Rates are the window's buckets summed and
+divided by its length, exposed as the `pishkhan_restapi_exception_rate` gauge when metrics are
+enabled.
+"""
+import time
+from collections import Counter
+
+from django.conf import settings
+from prometheus_client import REGISTRY
+
+from project.metrics import labeled_gauge_metric_generator
+from project.settings import VALUES
+
+
+def bucket_key(second):
+    return f'{VALUES["EXCEPTION_METRICS_PREFIX"]}:{second}'
+
+
+def record_exception(route, exception):
+    pipeline = settings.REDIS_CONNECTION.pipeline(transaction=True)
+    key = bucket_key(int(time.time()))
+    pipeline.hincrby(key, f'{route}\t{type(exception).__name__}', 1)
+    pipeline.expire(key, VALUES['EXCEPTION_METRICS_TTL'] + 1)
+    pipeline.execute()
+
+
+def exception_counts(window=None):
+    """ exceptions of the last `window` seconds (the whole window by default) per (route, exception class). """
+    window = window or VALUES['EXCEPTION_METRICS_TTL']
+    current = int(time.time())
+    pipeline = settings.REDIS_CONNECTION.pipeline(transaction=False)
+    for second in range(current - window + 1, current + 1):
+        pipeline.hgetall(bucket_key(second))
+    counts = Counter()
+    for bucket in pipeline.execute():
+        for field, count in bucket.items():
+            counts[tuple(field.decode().split('\t', 1))] += int(count)
+    return counts
+
+
+def exception_rates():
+    """ exceptions per second over the window, per (route, exception class). """
+    window = VALUES['EXCEPTION_METRICS_TTL']
+    return {labels: count / window for labels, count in exception_counts(window).items()}
+
+
+def register_collector():
+    """ expose the rates as the `pishkhan_restapi_exception_rate` gauge; called once metrics are enabled. """
+    REGISTRY.register(labeled_gauge_metric_generator(
+        exception_rates, 'exception_rate', 'Exceptions per second over the last EXCEPTION_METRICS_TTL seconds.',
+        labelnames=['route', 'exception'],
+    ))
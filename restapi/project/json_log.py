@@ -1,10 +1,12 @@
 from json_log_formatter import JSONFormatter
-import time
 
 
 class TaskSchedulerJsonFormatter(JSONFormatter):
 
     def json_record(self, message, extra, record):
         request = extra.pop('request', None)
-        extra['time'] = time.time()
+        # records may be written a while after they were made (see log_queue)
+        extra['time'] = record.created
+        if record.exc_text and not record.exc_info:
+            extra['exc_info'] = record.exc_text
         return super(TaskSchedulerJsonFormatter, self).json_record(message, extra, record)
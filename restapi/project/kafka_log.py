@@ -0,0 +1,282 @@
+"""
+Log shipping to kafka.
+
+`KafkaHandler`s format records as json and hand them to the process's one `KafkaShipper`,
+which sends them in per-topic batches from a background thread through a transport: the
+kafka producer by default, or anything with `send_batch(topic, messages)` (such as the
+in-process `InMemoryBroker` used by tests and benchmarks) named by `LOG_KAFKA_TRANSPORT`.
+
+Logging never waits for the broker: the producer is made and used only by the background
+thread. A batch that fails or times out, or finds no producer, is appended to a spill file
+instead, and for `LOG_KAFKA_RETRY_INTERVAL` seconds after a failure batches go straight to
+the spill file without trying the broker. Once a send succeeds again the spill file is
+replayed. Records are dropped only when the in-memory buffer or the spill file is full; every
+outcome is counted in `pishkhan_restapi_kafka_log_records_total`.
+"""
+import atexit
+import glob
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.utils.module_loading import import_string
+
+from project.log_queue import allocate_lock, sleep, start_new_thread
+from project.metrics import counter_metric
+from project.settings import VALUES
+
+logger = logging.getLogger(__name__)
+
+kafka_log_records = counter_metric(
+    'kafka_log_records', 'Log records shipped to kafka: sent, spilled, replayed or dropped.', labelnames=['outcome'],
+)
+
+
+class KafkaTransport:
+    """ one long-lived, batching and compressing kafka producer. """
+
+    def __init__(self, bootstrap_servers=None, compression_type=None, send_timeout=None):
+        from kafka import KafkaProducer
+
+        self.send_timeout = send_timeout or VALUES['LOG_KAFKA_SEND_TIMEOUT']
+        self.producer = KafkaProducer(
+            bootstrap_servers=bootstrap_servers or VALUES['KAFKA_BOOTSTRAP_SERVER'],
+            compression_type=compression_type or VALUES['LOG_KAFKA_COMPRESSION'],
+            linger_ms=50,
+            acks=1,
+            client_id=f'{os.uname().nodename}-{os.getpid()}',
+        )
+
+    def send_batch(self, topic, messages):
+        futures = [self.producer.send(topic, message) for message in messages]
+        self.producer.flush(timeout=self.send_timeout)
+        for future in futures:
+            # raises if the message was not delivered
+            future.get(timeout=0)
+
+    def close(self):
+        self.producer.close(timeout=self.send_timeout)
+
+
+class InMemoryBroker:
+    """ an in-process stand-in for kafka: topics are lists, and it can be made slow or down. """
+
+    def __init__(self, delay=0, down=False):
+        self.topics = defaultdict(list)
+        self.delay = delay
+        self.down = down
+        self.lock = threading.Lock()
+
+    def send_batch(self, topic, messages):
+        if self.delay:
+            sleep(self.delay)
+        if self.down:
+            raise ConnectionError('broker is down')
+        with self.lock:
+            self.topics[topic].extend(messages)
+
+    def close(self):
+        pass
+
+
+class KafkaShipper:
+    """
+    A bounded buffer of (topic, message) pairs, the thread that sends them and the spill file.
+
+    The transport is made by `make_transport` on first send, in the flusher thread, so neither
+    logging nor configuring it ever connects to the broker; failing to make it counts as the
+    broker being down.
+    """
+
+    def __init__(self, make_transport, max_records=10000, batch_size=500, flush_interval=0.1, spill_path=None,
+                 spill_max_bytes=0, retry_interval=5):
+        self.make_transport = make_transport
+        self.transport = None
+        self.max_records = max_records
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self.retry_interval = retry_interval
+        self.records = deque()
+        self.retry_at = 0
+        self.flush_lock = allocate_lock()
+        self.pid = None
+        self.replaying = None
+
+    def put(self, topic, message):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            start_new_thread(self.run, ())
+        if len(self.records) >= self.max_records:
+            kafka_log_records.labels(outcome='dropped').inc()
+            return
+        self.records.append((topic, message))
+
+    def run(self):
+        while True:
+            try:
+                if not self.flush():
+                    sleep(self.flush_interval)
+            except Exception as e:
+                logger.exception(e)
+                sleep(self.flush_interval)
+
+    def flush(self):
+        """ send (or spill) what is buffered now; the number of records handled. """
+        handled = 0
+        with self.flush_lock:
+            if self.broker_up():
+                self.replay()
+            while self.records:
+                batches = defaultdict(list)
+                for _ in range(min(self.batch_size, len(self.records))):
+                    topic, message = self.records.popleft()
+                    batches[topic].append(message)
+                for topic, messages in batches.items():
+                    self.send(topic, messages)
+                    handled += len(messages)
+        return handled
+
+    def broker_up(self):
+        return time.monotonic() >= self.retry_at
+
+    def send(self, topic, messages):
+        if self.broker_up():
+            try:
+                if self.transport is None:
+                    self.transport = self.make_transport()
+                self.transport.send_batch(topic, messages)
+                kafka_log_records.labels(outcome='sent').inc(len(messages))
+                return True
+            except Exception as e:
+                logger.warning(f'kafka log shipping failed, spilling for {self.retry_interval}s: {e}')
+                self.retry_at = time.monotonic() + self.retry_interval
+        self.spill(topic, messages)
+        return False
+
+    def spill(self, topic, messages):
+        # json records have no raw newlines, so a spilled record is one "topic\tmessage" line.
+        lines = b''.join(topic.encode() + b'\t' + message + b'\n' for message in messages)
+        try:
+            if not self.spill_path or self.spilled_bytes() + len(lines) > self.spill_max_bytes:
+                kafka_log_records.labels(outcome='dropped').inc(len(messages))
+                return
+            with open(self.spill_path, 'ab') as file:
+                file.write(lines)
+            kafka_log_records.labels(outcome='spilled').inc(len(messages))
+        except OSError as e:
+            logger.exception(e)
+            kafka_log_records.labels(outcome='dropped').inc(len(messages))
+
+    def spilled_bytes(self):
+        """ the size of the spill file and of the replay files waiting, except the one being replayed. """
+        paths = [self.spill_path, *glob.glob(glob.escape(self.spill_path) + '.*.replay')]
+        size = 0
+        for path in paths:
+            if path != self.replaying:
+                try:
+                    size += os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+        return size
+
+    def replay(self):
+        """
+        Send the spill file a batch at a time; what cannot be sent is spilled again. Workers
+        share the spill file and whichever renames it first replays it. A replay file left by
+        a worker that died while replaying, or by this one failing, is replayed first.
+        """
+        if not self.spill_path:
+            return
+        replaying = f'{self.spill_path}.{os.getpid()}.replay'
+        if os.path.exists(replaying):
+            self.replay_file(replaying)
+        for orphan in glob.glob(glob.escape(self.spill_path) + '.*.replay'):
+            pid = orphan.rsplit('.', 2)[-2]
+            if pid.isdigit() and not process_alive(int(pid)):
+                try:
+                    os.replace(orphan, replaying)
+                except FileNotFoundError:
+                    continue
+                self.replay_file(replaying)
+        try:
+            os.replace(self.spill_path, replaying)
+        except FileNotFoundError:
+            return
+        self.replay_file(replaying)
+
+    def replay_file(self, path):
+        self.replaying = path
+        try:
+            with open(path, 'rb') as file:
+                batches = defaultdict(list)
+                for line in file:
+                    topic, _, message = line.rstrip(b'\n').partition(b'\t')
+                    batch = batches[topic.decode()]
+                    batch.append(message)
+                    if len(batch) >= self.batch_size:
+                        self.send_replayed(topic.decode(), batches.pop(topic.decode()))
+                for topic, messages in batches.items():
+                    self.send_replayed(topic, messages)
+            os.remove(path)
+        finally:
+            self.replaying = None
+
+    def send_replayed(self, topic, messages):
+        if self.send(topic, messages):
+            kafka_log_records.labels(outcome='replayed').inc(len(messages))
+
+    def close(self):
+        self.flush()
+        if self.transport is not None:
+            self.transport.close()
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+_shippers = {}
+
+
+def get_shipper():
+    """ the process's shipper, over the transport `LOG_KAFKA_TRANSPORT` names. """
+    pid = os.getpid()
+    if pid not in _shippers:
+        _shippers.clear()
+        shipper = KafkaShipper(
+            lambda: import_string(VALUES['LOG_KAFKA_TRANSPORT'])(),
+            max_records=VALUES['LOG_KAFKA_MAX_RECORDS'], batch_size=VALUES['LOG_KAFKA_BATCH_SIZE'],
+            flush_interval=VALUES['LOG_KAFKA_FLUSH_INTERVAL'], spill_path=VALUES['LOG_KAFKA_SPILL_PATH'],
+            spill_max_bytes=VALUES['LOG_KAFKA_SPILL_MAX_BYTES'], retry_interval=VALUES['LOG_KAFKA_RETRY_INTERVAL'],
+        )
+        _shippers[pid] = shipper
+        atexit.register(shipper.close)
+    return _shippers[pid]
+
+
+class KafkaHandler(logging.Handler):
+    """ ships formatted records to `topic`; it never blocks, so the log queue leaves it alone. """
+    asynchronous = True
+
+    def __init__(self, topic, shipper=None, level=logging.NOTSET):
+        super().__init__(level)
+        self.topic = topic
+        self.shipper = shipper
+
+    def emit(self, record):
+        try:
+            # the process's shipper is looked up on use, so a forked worker gets its own.
+            shipper = self.shipper or get_shipper()
+            shipper.put(self.topic, self.format(record).encode())
+        except Exception:
+            self.handleError(record)
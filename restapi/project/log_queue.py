@@ -0,0 +1,175 @@
+"""
+Queue-backed logging.
+
+With `LOG_QUEUE_ENABLE`, `configure` puts every handler of the logging config behind one
+`LogQueue` per process: logging a record only appends it to a bounded in-memory queue, and a
+native thread writes the records out in batches. Under gevent's monkey patching a threading
+thread is a greenlet and its disk writes would still block the worker, so the flusher runs on
+an unpatched OS thread and sleeps with the unpatched `time.sleep`.
+
+When the queue is full a record is dropped, the new one (`drop_new`) or the oldest queued one
+(`drop_old`); drops are counted in `pishkhan_restapi_log_records_total`.
+"""
+import atexit
+import logging
+import logging.config
+import os
+from collections import deque
+
+from project.metrics import counter_metric
+from project.settings import VALUES
+
+try:
+    from gevent.monkey import get_original
+    start_new_thread = get_original('_thread', 'start_new_thread')
+    sleep = get_original('time', 'sleep')
+    allocate_lock = get_original('_thread', 'allocate_lock')
+except ImportError:
+    from _thread import allocate_lock, start_new_thread
+    from time import sleep
+
+log_records = counter_metric(
+    'log_records', 'Records that went through the log queue, by handler and outcome.', labelnames=['handler', 'outcome'],
+)
+
+DROP_NEW = 'drop_new'
+DROP_OLD = 'drop_old'
+
+
+class LogQueue:
+    """ a bounded queue of (handler, record) pairs and the thread that writes them out. """
+
+    def __init__(self, max_records=10000, batch_size=500, flush_interval=0.1, overflow=DROP_NEW):
+        if overflow not in (DROP_NEW, DROP_OLD):
+            raise ValueError(f'Unknown overflow policy {overflow}.')
+        self.max_records = max_records
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        # deque appends and pops are atomic, so greenlets and the flusher share it without a lock.
+        self.records = deque()
+        self.flush_lock = allocate_lock()
+        self.pid = None
+
+    def put(self, handler, record):
+        self.ensure_flusher()
+        if len(self.records) >= self.max_records:
+            if self.overflow == DROP_NEW:
+                log_records.labels(handler=handler.name, outcome='dropped').inc()
+                return
+            try:
+                dropped, _ = self.records.popleft()
+                log_records.labels(handler=dropped.name, outcome='dropped').inc()
+            except IndexError:
+                pass
+        self.records.append((handler, record))
+
+    def ensure_flusher(self):
+        # a forked worker has the queue but not the thread.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            start_new_thread(self.run, ())
+
+    def run(self):
+        while True:
+            try:
+                if not self.flush():
+                    sleep(self.flush_interval)
+            except Exception:
+                sleep(self.flush_interval)
+
+    def flush(self):
+        """ write out what is queued now, a batch at a time; the number of records written. """
+        written = 0
+        with self.flush_lock:
+            while self.records:
+                by_handler, size = {}, 0
+                while size < self.batch_size:
+                    try:
+                        handler, record = self.records.popleft()
+                    except IndexError:
+                        break
+                    by_handler.setdefault(handler, []).append(record)
+                    size += 1
+                for handler, records in by_handler.items():
+                    write_batch(handler, records)
+                written += size
+        return written
+
+
+def write_batch(handler, records):
+    """ format a handler's records and, for streams, write them with one write and one flush. """
+    records = [record for record in records if record.levelno >= handler.level and handler.filter(record)]
+    if not isinstance(handler, logging.StreamHandler) or handler.stream is None:
+        for record in records:
+            handler.handle(record)
+        log_records.labels(handler=handler.name, outcome='written').inc(len(records))
+        return
+    lines = []
+    for record in records:
+        try:
+            lines.append(handler.format(record) + handler.terminator)
+        except Exception:
+            log_records.labels(handler=handler.name, outcome='failed').inc()
+            handler.handleError(record)
+    if not lines:
+        return
+    # the flusher is the only writer of a queued handler, so its (possibly gevent) lock is not taken.
+    try:
+        handler.stream.write(''.join(lines))
+        handler.stream.flush()
+        log_records.labels(handler=handler.name, outcome='written').inc(len(lines))
+    except Exception:
+        log_records.labels(handler=handler.name, outcome='failed').inc(len(lines))
+        handler.handleError(records[-1])
+
+
+class QueuedHandler(logging.Handler):
+    """ hands records for `target` to a `LogQueue` instead of writing them. """
+
+    def __init__(self, target, log_queue):
+        super().__init__(target.level)
+        self.target = target
+        self.log_queue = log_queue
+        self.name = target.name
+
+    def emit(self, record):
+        try:
+            self.log_queue.put(self.target, self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    @staticmethod
+    def prepare(record):
+        """
+        Freeze what can change before the record is written: the message is rendered now
+        (its args may be mutated later) and a traceback is kept as text, not as live frames.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure(config):
+    """ `LOGGING_CONFIG` callable: the usual dictConfig, with the handlers queued if enabled. """
+    logging.config.dictConfig(config)
+    if not VALUES['LOG_QUEUE_ENABLE']:
+        return
+    log_queue = LogQueue(
+        max_records=VALUES['LOG_QUEUE_MAX_RECORDS'], batch_size=VALUES['LOG_QUEUE_BATCH_SIZE'],
+        flush_interval=VALUES['LOG_QUEUE_FLUSH_INTERVAL'], overflow=VALUES['LOG_QUEUE_OVERFLOW'],
+    )
+    queued = {}
+    for name in {'', *config.get('loggers', {})}:
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, QueuedHandler) or getattr(handler, 'asynchronous', False):
+                continue
+            if handler not in queued:
+                queued[handler] = QueuedHandler(handler, log_queue)
+            logger.removeHandler(handler)
+            logger.addHandler(queued[handler])
+    atexit.register(log_queue.flush)
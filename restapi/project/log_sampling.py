@@ -0,0 +1,98 @@
+"""
+Which requests get a request log, and how much of their body it keeps.
+
+The decision is made when the response is ready (tail-based), before any of the log is built:
+errors and requests slower than their route's threshold are always logged, everything else
+is sampled at `LOG_SAMPLE_RATE` by a hash of the request id, so one request is decided the
+same way wherever its id is seen.
+
+Bodies are captured before the view runs but parsed only for a log that is written. A body of
+at most `LOG_BODY_MAX_BYTES` is kept as bytes; a larger one is not read ahead of the view at
+all, it is hashed and counted as the view reads it and logged as that hash and length.
+"""
+from hashlib import sha1, sha256
+
+from project.metrics import counter_metric
+from project.settings import VALUES
+
+request_logs = counter_metric(
+    'request_logs', 'Request log decisions: error, slow, sampled or dropped.', labelnames=['decision'],
+)
+request_log_body_bytes = counter_metric(
+    'request_log_body_bytes', 'Request body bytes of logged requests, logged or (over the budget) only hashed.', labelnames=['outcome'],
+)
+
+
+def sampled(request_id, rate):
+    """ whether a request id falls in the sample; the same id always does or does not. """
+    if rate >= 1:
+        return True
+    return int(sha1(request_id.encode()).hexdigest()[:8], 16) < rate * 0x100000000
+
+
+def log_decision(request, response, run_time):
+    """ why the request is logged ('error', 'slow' or 'sampled'), or None to drop its log. """
+    if response.status_code >= 400 or request.exception_message:
+        decision = 'error'
+    elif run_time >= VALUES['LOG_SLOW_REQUEST_THRESHOLDS'].get(route_name(request), VALUES['LOG_SLOW_REQUEST_THRESHOLD']):
+        decision = 'slow'
+    elif sampled(request.request_id, VALUES['LOG_SAMPLE_RATE']):
+        decision = 'sampled'
+    else:
+        decision = None
+    request_logs.labels(decision=decision or 'dropped').inc()
+    return decision
+
+
+def route_name(request):
+    """ the url name of the matched route, None where nothing matched. """
+    return getattr(request.resolver_match, 'url_name', None)
+
+
+def count_logged_body(captured):
+    """ count the body bytes of a written log, as logged or (for bodies over the budget) hashed. """
+    if isinstance(captured, HashingStream):
+        request_log_body_bytes.labels(outcome='hashed').inc(captured.length)
+    elif captured:
+        request_log_body_bytes.labels(outcome='logged').inc(len(captured))
+
+
+class HashingStream:
+    """ reads through to `stream`, hashing and counting the bytes that pass. """
+
+    def __init__(self, stream, expected_length):
+        self.stream = stream
+        self.expected_length = expected_length
+        self.hash = sha256()
+        self.length = 0
+
+    def _seen(self, data):
+        self.hash.update(data)
+        self.length += len(data)
+        return data
+
+    def read(self, *args, **kwargs):
+        return self._seen(self.stream.read(*args, **kwargs))
+
+    def readline(self, *args, **kwargs):
+        return self._seen(self.stream.readline(*args, **kwargs))
+
+    def summary(self):
+        """ what is logged in place of the body; `complete` is False if the view did not read all of it. """
+        return {'sha256': self.hash.hexdigest(), 'length': self.length, 'complete': self.length == self.expected_length}
+
+
+def capture_body(request):
+    """
+    The body as bytes if it fits the budget, otherwise a `HashingStream` put between the
+    request and its input, so the view still reads (or streams) the body itself.
+    """
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length <= VALUES['LOG_BODY_MAX_BYTES']:
+        return request.body
+    # HttpRequest.read() and request.body both read through `_stream`.
+    request._stream = HashingStream(request._stream, length)
+    return request._stream
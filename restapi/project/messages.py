@@ -27,6 +27,12 @@ MESSAGES = {
     'insta_not_available': {'fa': 'اینستاگرام پاسخ‌گو نمی‌باشد!', 'en': 'Instagram is not responsive!'},
     'create_contact_conflict': {'fa': 'شماره وارد شده از قبل در مخاطبین شما قرار دارد.', 'en': 'The entered number is already in your contacts.'},
 
+    # Tasks app
+    'precondition_owner': {'fa': 'پیش‌نیازها باید از وظایف همین کاربر باشند!', 'en': 'Preconditions must be tasks of the same owner!'},
+    'precondition_cycle': {'fa': 'این پیش‌نیازها یک دور در وظایف ایجاد می‌کنند!', 'en': 'These preconditions make a cycle between tasks!'},
+    'task_ref_repeated': {'fa': 'شناسه موقت {ref} تکراری است!', 'en': 'Temporary id {ref} is repeated!'},
+    'task_ref_unknown': {'fa': 'پیش‌نیاز {ref} در این وظایف نیست!', 'en': 'Precondition {ref} is not one of these tasks!'},
+
     # Statuses
     208: {'fa': 'این درخواست قبلاً گزارش شده است!', 'en': 'This request was reported before!'},
     400: {'fa': 'درخواست نامناسب!', 'en': 'Bad request!'},
@@ -2,6 +2,7 @@ from json import dumps
 from logging import getLogger
 from threading import Thread
 from django.utils.timezone import now
+from prometheus_client import Counter
 from prometheus_client.core import GaugeMetricFamily, GaugeHistogramMetricFamily, InfoMetricFamily, StateSetMetricFamily
 
 logger = getLogger(__name__)
@@ -66,6 +67,28 @@ def gauge_histogram_metric_generator(get_values, name, documentation=None):
     return GaugeHistogramMetricCollector()
 
 
+def labeled_gauge_metric_generator(get_values, name, documentation=None, labelnames=()):
+    """ one gauge per label set; `get_values` returns {(label values, ...): value}. """
+    class LabeledGaugeMetricCollector:
+        def __init__(self):
+            self.get_value = generator_metrice_value(get_values)
+
+        def describe(self):
+            # registering describes the collector instead of collecting it, which would read the values.
+            yield GaugeMetricFamily(f'pishkhan_restapi_{name}', documentation or f'Value of {name}', labels=labelnames)
+
+        def collect(self):
+            gauge_metric = GaugeMetricFamily(f'pishkhan_restapi_{name}', documentation or f'Value of {name}', labels=labelnames)
+            values = self.get_value()
+            if values is not None:
+                timestamp = now().timestamp()
+                for labels, value in values.items():
+                    gauge_metric.add_metric(labels=list(labels), value=value, timestamp=timestamp)
+            yield gauge_metric
+
+    return LabeledGaugeMetricCollector()
+
+
 def info_metric_generator(get_info, name, documentation=None):
     class InfoMetricCollector:
         def __init__(self):
@@ -105,3 +128,5 @@ def state_set_metric_generator(state_checker, name, documentation=None):
 
 
 
+def counter_metric(name, documentation=None, labelnames=()):
+    return Counter(f'pishkhan_restapi_{name}', documentation or f'Count of {name}', labelnames=labelnames)
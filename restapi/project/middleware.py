@@ -1,12 +1,13 @@
-import json, logging, socket, time
+import json, logging, socket
 
-from django.urls import resolve
 from django.core.cache import cache
 from django.http import HttpResponse, HttpResponseServerError
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
-from django.utils.timezone import now
-from project import settings
+from project.exception_rates import record_exception
+from project.log_sampling import HashingStream, capture_body, count_logged_body, log_decision, route_name
 from project.settings import VALUES
+from project.timing import RequestTimer
 import uuid
 from project.tools import mask_sensitive_args
 
@@ -17,28 +18,42 @@ requests_logger = logging.getLogger('requests_logger')
 class ResponseLogMiddleware(MiddlewareMixin):
     """Response Logging Middleware."""
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.body = None
-        self.get_params = None
-        self.start_time = None
+    def __call__(self, request):
+        """ everything a request's log needs is kept on the request, never on this shared instance. """
+        request.timing = RequestTimer()
+        with request.timing.timing_queries():
+            return super().__call__(request)
 
     def process_request(self, request):
         request.exception_message = ""
         request.request_id = str(uuid.uuid4().hex)
-        self.start_time = time.time()
-        self.body = {}
-        self.get_params = {}
-        """Set Request Start Time to measure time taken to service request."""
-        if request.method in ['POST', 'PUT', 'DELETE']:
-            try:
-                body_unicode = request.body.decode('utf-8')
-                body = json.loads(body_unicode)
-            except Exception:
-                body = dict(request.POST)
-            self.body = body
+        # captured before a view consumes the stream, and only parsed if it is logged.
+        request.log_raw_body = None
+        request.log_params = {}
+        if request.method in ['POST', 'PUT', 'DELETE'] and request.content_type not in VALUES['STREAMING_CONTENT_TYPES']:
+            request.log_raw_body = capture_body(request)
         if request.method == 'GET':
-            self.get_params = request.GET
+            request.log_params = request.GET
+
+    @staticmethod
+    def request_body(request):
+        if request.log_raw_body is None:
+            return {}
+        if isinstance(request.log_raw_body, HashingStream):
+            return request.log_raw_body.summary()
+        try:
+            return json.loads(request.log_raw_body.decode('utf-8'))
+        except Exception:
+            return dict(request.POST)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing.mark('view')
+
+    def process_template_response(self, request, response):
+        timer = request.timing
+        timer.mark('view_returned')
+        response.add_post_render_callback(lambda rendered: timer.mark('rendered'))
+        return response
 
     def extract_log_info(self, request, response=None, exception=None):
         """Extract appropriate log info from requests/responses/exceptions."""
@@ -49,21 +64,27 @@ class ResponseLogMiddleware(MiddlewareMixin):
             'server_hostname': socket.gethostname(),
             'request_path': request.get_full_path(),
             'request_user': str(request.user.id) if request.user else None,
-            'route_name': resolve(request.path_info).url_name,
-            'run_time': time.time() - self.start_time,
+            'route_name': route_name(request),
+            'run_time': request.timing.elapsed(),
             'response_status': response.status_code,
-            'request_body': self.body,
-            'params': self.get_params,
+            'request_body': self.request_body(request),
+            'params': request.log_params,
             'device': request.headers.get('user-device', 'unknown')
-        }
+        } | request.timing.fields()
         if VALUES['HEADER_LOGGER_ENABLE']:
             log_data |= {'HEADERS': request.headers}
         return log_data
 
     def process_response(self, request, response):
         """Log data using logger."""
+        request.timing.mark('response')
+        decision = log_decision(request, response, request.timing.elapsed())
+        if decision is None:
+            return response
         log_data = self.extract_log_info(request=request, response=response)
         log_data = mask_sensitive_args(log_data)
+        log_data['log_decision'] = decision
+        count_logged_body(request.log_raw_body)
         requests_logger.info(msg=request.exception_message, extra=log_data)
 
         return response
@@ -74,7 +95,10 @@ class ResponseLogMiddleware(MiddlewareMixin):
         try:
             raise exception
         except Exception as e:
-            cache.set(f'{VALUES["EXCEPTION_METRICS_PREFIX"]}-{now().timestamp()}', 1, VALUES['EXCEPTION_METRICS_TTL'])
+            try:
+                record_exception(route_name(request), e)
+            except Exception as error:
+                logger.exception(error)
             logger.exception(msg=e)
         raise
 
@@ -87,8 +111,18 @@ class ResponseHeaderMiddleware(MiddlewareMixin):
             headers = response.headers.get('Allow').split(',')
             checked_headers = [header for header in headers if header not in [' HEAD', ' OPTIONS']]
             response.headers['Allow'] = ','.join(checked_headers)
+        if response.has_header('ETag'):
+            self.patch_conditional_headers(response)
         return response
 
+    @staticmethod
+    def patch_conditional_headers(response):
+        """ tagged responses are per user and always revalidated; a 304 gets the same headers as its 200. """
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization', 'Cookie'])
+        if response.status_code == 304 and response.has_header('Content-Type'):
+            del response['Content-Type']
+
 
 class HealthCheckMiddleware(object):
     def __init__(self, get_response):
@@ -124,7 +158,8 @@ class HealthCheckMiddleware(object):
         try:
 
             from django_redis import get_redis_connection
-            if settings.CACHES.get("default").get("BACKEND") == "django_redis.cache.RedisCache" :
+            from django_redis.cache import RedisCache
+            if isinstance(cache, RedisCache):
                 get_redis_connection('default')
             else:
                 cache.set("Cache_Health", "Healthy", 1)
@@ -1,13 +1,28 @@
-from rest_framework.pagination import LimitOffsetPagination
+import json
+from base64 import b64decode, b64encode
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
 
 
 class CustomLimitOffsetPagination(LimitOffsetPagination):
+    max_limit = 1000
+
     def paginate_queryset(self, queryset, request, view=None):
         self.limit = self.get_limit(request)
         if self.limit is None:
             return None
         if self.limit == "inf":
-            return list(queryset)
+            return list(queryset[:self.max_limit])
         self.count = self.get_count(queryset)
         self.offset = self.get_offset(request)
         self.request = request
@@ -18,3 +33,131 @@ class CustomLimitOffsetPagination(LimitOffsetPagination):
             return []
         return list(queryset[self.offset:self.offset + self.limit])
 
+
+def approximate_count(queryset):
+    """ the planner's row estimate for a queryset (postgres only), None where there is no such estimate. """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    try:
+        plan = json.loads(queryset.explain(format='json'))
+        return plan[0]['Plan']['Plan Rows']
+    except Exception:
+        return None
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages that continue from the last row of the previous page instead of skipping an offset.
+
+    Rows are ordered by (`time_field`, id) and the cursor is that pair for the row a page starts
+    after (or, going back, before), so every page is one index range scan of `limit + 1` rows
+    however deep it is (given an index on (`time_field`, id), after any equality filters), and rows added or removed meanwhile never shift a page. There is no
+    COUNT: `?total=true` adds the planner's estimate of the total where the database has one.
+    """
+    time_field = 'send_time'
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    total_query_param = 'total'
+    default_limit = api_settings.PAGE_SIZE or 10
+    max_limit = 1000
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        position, self.reverse = self.decode_cursor(request)
+        self.total = approximate_count(queryset) if request.query_params.get(self.total_query_param) == 'true' else None
+        self.cursor_given = position is not None
+
+        time_field = self.time_field
+        if self.reverse:
+            queryset = queryset.order_by(f'-{time_field}', '-id')
+        else:
+            queryset = queryset.order_by(time_field, 'id')
+        if position is not None:
+            time, pk = position
+            lookup = 'lt' if self.reverse else 'gt'
+            # the OR alone is no index bound; the redundant `gte`/`lte` makes the scan start at the cursor.
+            queryset = queryset.filter(
+                Q(**{f'{time_field}__{lookup}e': time}),
+                Q(**{f'{time_field}__{lookup}': time}) | Q(**{time_field: time, f'id__{lookup}': pk}),
+            )
+
+        page = list(queryset[:self.limit + 1])
+        self.has_more = len(page) > self.limit
+        page = page[:self.limit]
+        if self.reverse:
+            page.reverse()
+        self.page = page
+        return page
+
+    def get_limit(self, request):
+        try:
+            return _positive_int(request.query_params[self.limit_query_param], strict=True, cutoff=self.max_limit)
+        except (KeyError, ValueError):
+            return self.default_limit
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            microseconds, pk, reverse = json.loads(b64decode(encoded.encode('ascii'), altchars=b'-_'))
+            return (EPOCH + timedelta(microseconds=int(microseconds)), int(pk)), bool(reverse)
+        except (TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        """ rows are model instances or `.values()` dicts that include the time field and id. """
+        if isinstance(row, dict):
+            time, pk = row[self.time_field], row['id']
+        else:
+            time, pk = getattr(row, self.time_field), row.pk
+        payload = json.dumps([(time - EPOCH) // timedelta(microseconds=1), pk, int(reverse)], separators=(',', ':'))
+        encoded = b64encode(payload.encode('ascii'), altchars=b'-_').decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        # going back, the page we came from is always there
+        if not self.page or not (self.has_more or self.reverse):
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.page:
+            return None
+        if self.reverse and not self.has_more:
+            return None
+        if not self.reverse and not self.cursor_given:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
+        if self.total is not None:
+            response['total'] = self.total
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'total': {'type': 'integer', 'description': 'estimated, only with total=true'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query', 'schema': {'type': 'string'},
+             'description': 'The pagination cursor value.'},
+            {'name': self.limit_query_param, 'required': False, 'in': 'query', 'schema': {'type': 'integer'},
+             'description': 'Number of results to return per page.'},
+            {'name': self.total_query_param, 'required': False, 'in': 'query', 'schema': {'type': 'boolean'},
+             'description': 'Include an estimate of the total number of results.'},
+        ]
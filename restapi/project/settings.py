@@ -46,6 +46,19 @@ MANAGERS = ADMINS
 ########## END MANAGER CONFIGURATION
 
 
+########## EMAIL CONFIGURATION
+# See: https://docs.djangoproject.com/en/dev/ref/settings/#email-backend
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'false') == 'true'
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 10))
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'webmaster@localhost')
+########## END EMAIL CONFIGURATION
+
+
 ########## DATABASE CONFIGURATION
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#databases
 DATABASES = {
@@ -66,11 +79,13 @@ DATABASES = {
 
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "project.cache.TwoTierRedisCache",
         "LOCATION": os.getenv('REDIS_SERVICE_HOST', 'redis'),
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
-            "MAX_ENTRIES": 1000,
+            # entries of the in-process tier, per worker
+            "MAX_ENTRIES": int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 1000)),
+            "LOCAL_TIMEOUT": int(os.getenv('CACHE_LOCAL_TIMEOUT', 60)),
             "PASSWORD": os.getenv('REDIS_PASSWORD', ''),
         },
         "KEY_PREFIX": "Nilva"
@@ -329,6 +344,8 @@ LOGGING = {
         }
     }
 }
+# with LOG_QUEUE_ENABLE, records are written by a background thread (see project.log_queue)
+LOGGING_CONFIG = 'project.log_queue.configure'
 ########## END LOGGING CONFIGURATION
 
 ########## CORS
@@ -397,20 +414,76 @@ VALUES = {
 
     # Kafka vars
     "KAFKA_BOOTSTRAP_SERVER": os.getenv('KAFKA_BOOTSTRAP_SERVER', 'kafka:9092').split(','),
+    # ship request, provider and job logs to kafka as well (see project.kafka_log)
+    "LOG_KAFKA_ENABLE": os.getenv('LOG_KAFKA_ENABLE', 'false') == 'true',
+    "LOG_KAFKA_TOPIC_PREFIX": os.getenv('LOG_KAFKA_TOPIC_PREFIX', 'restapi-logs-'),
+    "LOG_KAFKA_TRANSPORT": os.getenv('LOG_KAFKA_TRANSPORT', 'project.kafka_log.KafkaTransport'),
+    "LOG_KAFKA_COMPRESSION": os.getenv('LOG_KAFKA_COMPRESSION', 'gzip'),
+    "LOG_KAFKA_SEND_TIMEOUT": float(os.getenv('LOG_KAFKA_SEND_TIMEOUT', 5)),
+    "LOG_KAFKA_MAX_RECORDS": int(os.getenv('LOG_KAFKA_MAX_RECORDS', 10000)),
+    "LOG_KAFKA_BATCH_SIZE": int(os.getenv('LOG_KAFKA_BATCH_SIZE', 500)),
+    "LOG_KAFKA_FLUSH_INTERVAL": float(os.getenv('LOG_KAFKA_FLUSH_INTERVAL', 0.2)),
+    "LOG_KAFKA_RETRY_INTERVAL": float(os.getenv('LOG_KAFKA_RETRY_INTERVAL', 5)),
+    "LOG_KAFKA_SPILL_PATH": os.getenv('LOG_KAFKA_SPILL_PATH', '/django/kafka-spill.log'),
+    "LOG_KAFKA_SPILL_MAX_BYTES": int(os.getenv('LOG_KAFKA_SPILL_MAX_BYTES', 256 * 1024 * 1024)),
 
     # Metrics
     "IS_ENABLE_METRICS": os.getenv('ENABLE_METRICS', 'false') == 'true',
     "METRICS_EXPORT_PORT": int(os.getenv("METRICS_EXPORT_PORT", 8001)),
     "EXCEPTION_METRICS_PREFIX": os.getenv('EXCEPTION_METRICS_PREFIX', 'exception-metrics-prefix'),
-    "EXCEPTION_METRICS_TTL": os.getenv('EXCEPTION_METRICS_TTL', 5 * 60),
+    # window of the exception rates, in seconds
+    "EXCEPTION_METRICS_TTL": int(os.getenv('EXCEPTION_METRICS_TTL', 5 * 60)),
     "PING_INTERNET_SERVER_TIMEOUT": int(os.getenv('PING_INTERNET_SERVER_TIMEOUT', 3)),
     "CHECK_INTERNET_HOST": os.getenv('CHECK_INTERNET_HOST', 'google.com'),
 
     "HEADER_LOGGER_ENABLE": os.getenv('HEADER_LOGGER_ENABLE', "false") == "true",
+    # requests under their route's threshold (seconds) that are not errors are logged at LOG_SAMPLE_RATE
+    "LOG_SAMPLE_RATE": float(os.getenv('LOG_SAMPLE_RATE', 1)),
+    "LOG_SLOW_REQUEST_THRESHOLD": float(os.getenv('LOG_SLOW_REQUEST_THRESHOLD', 1)),
+    # route_name=seconds;...
+    "LOG_SLOW_REQUEST_THRESHOLDS": {
+        route: float(seconds) for route, seconds in
+        (item.split('=') for item in os.getenv('LOG_SLOW_REQUEST_THRESHOLDS', 'task_export=10;bulk_create=5').split(';') if item)
+    },
+    "LOG_BODY_MAX_BYTES": int(os.getenv('LOG_BODY_MAX_BYTES', 16 * 1024)),
+    "LOG_MASK_MAX_DEPTH": int(os.getenv('LOG_MASK_MAX_DEPTH', 10)),
+    "LOG_MASK_MAX_ITEMS": int(os.getenv('LOG_MASK_MAX_ITEMS', 1000)),
+    "LOG_QUEUE_ENABLE": os.getenv('LOG_QUEUE_ENABLE', "false") == "true",
+    "LOG_QUEUE_MAX_RECORDS": int(os.getenv('LOG_QUEUE_MAX_RECORDS', 10000)),
+    "LOG_QUEUE_BATCH_SIZE": int(os.getenv('LOG_QUEUE_BATCH_SIZE', 500)),
+    "LOG_QUEUE_FLUSH_INTERVAL": float(os.getenv('LOG_QUEUE_FLUSH_INTERVAL', 0.1)),
+    # drop_new or drop_old
+    "LOG_QUEUE_OVERFLOW": os.getenv('LOG_QUEUE_OVERFLOW', 'drop_new'),
     "MAX_WORKERS": int(os.getenv('MAX_WORKERS', 8)),
     "TIME_OUT": int(os.getenv('TIME_OUT', 900)),
+
+    # Tasks
+    "STREAMING_CONTENT_TYPES": os.getenv('STREAMING_CONTENT_TYPES', 'application/x-ndjson').split(';'),
+    "TASKS_BULK_VALIDATE_MAX_LINE_SIZE": int(os.getenv('TASKS_BULK_VALIDATE_MAX_LINE_SIZE', 1024 * 1024)),
+    "TASKS_BULK_CREATE_MAX_TASKS": int(os.getenv('TASKS_BULK_CREATE_MAX_TASKS', 10000)),
+    "TASKS_EXPORT_CHUNK_SIZE": int(os.getenv('TASKS_EXPORT_CHUNK_SIZE', 2000)),
+    "TASKS_VALIDATION_CACHE_TTL": int(os.getenv('TASKS_VALIDATION_CACHE_TTL', 5 * 60)),
+    "TASKS_PRECONDITION_GAP": timedelta(seconds=float(os.getenv('TASKS_PRECONDITION_GAP', 1))),
+    "TASKS_DISPATCH_BACKEND": os.getenv('TASKS_DISPATCH_BACKEND', 'redis'),
+    "TASKS_DISPATCH_QUEUE_KEY": os.getenv('TASKS_DISPATCH_QUEUE_KEY', 'tasks-dispatch'),
+    "TASKS_DISPATCH_LEASE": int(os.getenv('TASKS_DISPATCH_LEASE', 60)),
+    "TASKS_DISPATCH_BATCH_SIZE": int(os.getenv('TASKS_DISPATCH_BATCH_SIZE', 500)),
+    "TASKS_DISPATCH_POLL_INTERVAL": float(os.getenv('TASKS_DISPATCH_POLL_INTERVAL', 1)),
+    "TASKS_DISPATCH_HORIZON": float(os.getenv('TASKS_DISPATCH_HORIZON', 5 * 60)),
+    "TASKS_DISPATCH_REFILL_INTERVAL": float(os.getenv('TASKS_DISPATCH_REFILL_INTERVAL', 5)),
+    "TASKS_SMTP_POOL_SIZE": int(os.getenv('TASKS_SMTP_POOL_SIZE', os.getenv('MAX_WORKERS', 8))),
+    "TASKS_SMTP_MESSAGES_PER_SEND": int(os.getenv('TASKS_SMTP_MESSAGES_PER_SEND', 50)),
 }
 
+if VALUES['LOG_KAFKA_ENABLE']:
+    for logger_name, topic in [('requests_logger', 'requests'), ('provider_logger', 'providers'), ('jobs_logger', 'jobs')]:
+        LOGGING['handlers'][f'kafka_{topic}'] = {
+            '()': 'project.kafka_log.KafkaHandler',
+            'topic': VALUES['LOG_KAFKA_TOPIC_PREFIX'] + topic,
+            'formatter': 'json',
+        }
+        LOGGING['loggers'][logger_name]['handlers'].append(f'kafka_{topic}')
+
 # Prometheus config
 if VALUES['IS_ENABLE_METRICS']:
     PROMETHEUS_METRICS_EXPORT_PORT_RANGE = range(VALUES['METRICS_EXPORT_PORT'], VALUES['METRICS_EXPORT_PORT'] + 1)
@@ -0,0 +1,428 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from hashlib import sha256
+from io import StringIO
+from unittest.mock import patch
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY, CollectorRegistry
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from middleware import ResponseLogMiddleware
+from project.apps.profile.models import User
+
+from project import cache as cache_module
+from project.cache import TwoTierRedisCache
+from project.exception_rates import exception_counts, exception_rates, record_exception
+from project.json_log import TaskSchedulerJsonFormatter
+from project.kafka_log import InMemoryBroker, KafkaHandler, KafkaShipper
+from project.log_queue import DROP_OLD, LogQueue, QueuedHandler
+from project.log_sampling import sampled
+from project.metrics import labeled_gauge_metric_generator
+from project.tools import MASK, mask_sensitive_args
+
+
+class TwoTierRedisCacheTest(SimpleTestCase):
+
+    def make_cache(self, worker=True):
+        """ a cache instance; with `worker` in a tier of its own, as in another worker process. """
+        if worker:
+            cache_module._tiers.clear()
+        params = settings.CACHES['default'] | {'KEY_PREFIX': 'two-tier-test'}
+        params['OPTIONS'] = params.get('OPTIONS', {}) | {'MAX_ENTRIES': 3, 'LOCAL_TIMEOUT': 60}
+        cache = TwoTierRedisCache(params['LOCATION'], params)
+        self.addCleanup(cache.delete_pattern, '*')
+        # subscribing empties the local tier, so it is done before anything is cached
+        cache._tier.ensure_subscriber()
+        self.assertTrue(cache._tier.subscribed.wait(2))
+        return cache
+
+    @staticmethod
+    def events(event):
+        return REGISTRY.get_sample_value('pishkhan_restapi_cache_local_events_total', {'event': event}) or 0
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_local_tier(self):
+        cache = self.make_cache()
+        cache.set('a', {'tasks': [1, 2]})
+        hits, misses = self.events('hit'), self.events('miss')
+        self.assertDictEqual(cache.get('a'), {'tasks': [1, 2]})
+        value = cache.get('a')
+        self.assertEqual((self.events('hit'), self.events('miss')), (hits + 1, misses + 1))
+        # callers get their own copy
+        value['tasks'].append(3)
+        self.assertDictEqual(cache.get('a'), {'tasks': [1, 2]})
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual(cache.get('missing', 'default'), 'default')
+
+        evictions = self.events('eviction')
+        cache.set_many({'b': 2, 'c': 3, 'd': 4})
+        self.assertDictEqual(cache.get_many(['a', 'b', 'c', 'd']), {'a': {'tasks': [1, 2]}, 'b': 2, 'c': 3, 'd': 4})
+        self.assertEqual(len(cache._tier.entries), 3)
+        self.assertEqual(self.events('eviction'), evictions + 1)
+
+    def test_redis_ttl(self):
+        cache = self.make_cache()
+        cache.set('short', 1, timeout=0.3)
+        cache.set_many({'many': 2}, timeout=0.3)
+        cache.set('long', 3)
+        self.assertEqual(cache.get('short'), 1)
+        self.assertDictEqual(cache.get_many(['many', 'long']), {'many': 2, 'long': 3})
+        # local copies go with their key in redis, not LOCAL_TIMEOUT later
+        time.sleep(0.4)
+        self.assertFalse(cache.has_key('short'))
+        self.assertIsNone(cache.get('short'))
+        self.assertDictEqual(cache.get_many(['many', 'long']), {'long': 3})
+
+    def test_invalidation(self):
+        cache1, cache2 = self.make_cache(), self.make_cache()
+        cache1.set('key', 1)
+        self.assertEqual(cache1.get('key'), 1)
+        self.assertEqual(cache2.get('key'), 1)
+
+        cache1.set('key', 2)
+        self.wait_for(lambda: cache2.make_key('key') not in cache2._tier.entries)
+        self.assertEqual(cache2.get('key'), 2)
+        cache1.incr('key')
+        self.wait_for(lambda: cache2.make_key('key') not in cache2._tier.entries)
+        self.assertEqual(cache2.get('key'), 3)
+        cache2.delete('key')
+        self.wait_for(lambda: cache1.make_key('key') not in cache1._tier.entries)
+        self.assertIsNone(cache1.get('key'))
+
+    def test_shared_tier(self):
+        cache = self.make_cache()
+        subscribers = [thread for thread in threading.enumerate() if thread.name == 'cache-invalidation']
+        caches = []
+        threads = [threading.Thread(target=lambda: caches.append(self.make_cache(worker=False))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # one LRU, one subscriber and one redis client however many instances the process makes
+        self.assertTrue(all(other._tier is cache._tier and other.client is cache.client for other in caches))
+        self.assertListEqual([thread for thread in threading.enumerate() if thread.name == 'cache-invalidation'], subscribers)
+        cache.set('key', 1)
+        self.assertEqual(cache.get('key'), 1)
+        hits = self.events('hit')
+        self.assertEqual(caches[0].get('key'), 1)
+        self.assertEqual(self.events('hit'), hits + 1)
+
+
+class LogQueueTest(SimpleTestCase):
+
+    def make_logger(self, **kwargs):
+        stream = StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.name = 'log-queue-test'
+        handler.setFormatter(TaskSchedulerJsonFormatter())
+        log_queue = LogQueue(flush_interval=60, **kwargs)
+        # no flusher thread, the test flushes
+        log_queue.ensure_flusher = lambda: None
+        logger = logging.getLogger(f'log-queue-test.{id(log_queue)}')
+        logger.propagate = False
+        logger.addHandler(QueuedHandler(handler, log_queue))
+        self.addCleanup(logger.handlers.clear)
+        return logger, log_queue, stream
+
+    @staticmethod
+    def records(outcome):
+        return REGISTRY.get_sample_value('pishkhan_restapi_log_records_total', {'handler': 'log-queue-test', 'outcome': outcome}) or 0
+
+    def test_batches(self):
+        logger, log_queue, stream = self.make_logger(batch_size=2)
+        data = {'status': 200}
+        logger.warning('request %s', data, extra={'request_id': 'a'})
+        data['status'] = 500
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('failed')
+        self.assertEqual(stream.getvalue(), '')
+
+        written = self.records('written')
+        self.assertEqual(log_queue.flush(), 2)
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(self.records('written'), written + 2)
+        # what was logged, not what the arguments turned into later
+        self.assertEqual(lines[0]['message'], "request {'status': 200}")
+        self.assertEqual(lines[0]['request_id'], 'a')
+        self.assertIn('ValueError: boom', lines[1]['exc_info'])
+
+    def test_overflow(self):
+        logger, log_queue, stream = self.make_logger(max_records=2)
+        dropped = self.records('dropped')
+        for i in range(3):
+            logger.warning(f'record {i}')
+        log_queue.flush()
+        self.assertListEqual([json.loads(line)['message'] for line in stream.getvalue().splitlines()], ['record 0', 'record 1'])
+
+        logger, log_queue, stream = self.make_logger(max_records=2, overflow=DROP_OLD)
+        for i in range(3):
+            logger.warning(f'record {i}')
+        log_queue.flush()
+        self.assertListEqual([json.loads(line)['message'] for line in stream.getvalue().splitlines()], ['record 1', 'record 2'])
+        self.assertEqual(self.records('dropped'), dropped + 2)
+
+
+class RequestTimingTest(APITestCase):
+
+    def test_phases(self):
+        self.client.force_authenticate(User.objects.create(first_name='nilva', last_name='man', email='nilva.man@test.com'))
+        with self.assertLogs('requests_logger') as logs:
+            self.client.get(reverse('tasks:task_list'))
+        record = logs.records[-1]
+        for phase in ['request', 'view', 'render', 'response', 'db']:
+            self.assertGreaterEqual(getattr(record, f'timing_{phase}'), 0)
+        self.assertGreater(record.timing_db, 0)
+        self.assertGreater(record.timing_db_queries, 0)
+        self.assertGreaterEqual(record.run_time * 1000, record.timing_view + record.timing_render)
+
+    def test_concurrent_requests(self):
+        """ a request handled while another is in flight (as greenlets interleave) leaves the other's log data alone. """
+        factory = RequestFactory()
+        path = reverse('tasks:task_list')
+
+        def get_response(request):
+            if json.loads(request.body)['title'] == 'outer':
+                inner = factory.post(path, {'title': 'inner'}, content_type='application/json')
+                inner.user = None
+                middleware(inner)
+            return HttpResponse()
+
+        middleware = ResponseLogMiddleware(get_response)
+        outer = factory.post(path, {'title': 'outer'}, content_type='application/json')
+        outer.user = None
+        with self.assertLogs('requests_logger') as logs:
+            middleware(outer)
+        self.assertListEqual([record.request_body['title'] for record in logs.records], ['inner', 'outer'])
+        self.assertGreater(logs.records[1].run_time, logs.records[0].run_time)
+
+
+class MaskSensitiveArgsTest(SimpleTestCase):
+
+    def test_mask(self):
+        nested = {'id': 1, 'Refresh_Token': 'abc'}
+        unchanged = {'title': 'task', 'send_time': '2020-05-10'}
+        data = {'user': {'Password': 'p', 'name': 'n'}, 'tasks': [nested, unchanged], 'sms_code': 1234, 'tokens': ['a']}
+        masked = mask_sensitive_args(data)
+        self.assertDictEqual(masked, {
+            'user': {'Password': MASK, 'name': 'n'},
+            'tasks': [{'id': 1, 'Refresh_Token': MASK}, unchanged],
+            'sms_code': MASK,
+            'tokens': ['a'],
+        })
+        # the payload itself is left alone, and untouched parts are shared rather than copied
+        self.assertEqual(data['user']['Password'], 'p')
+        self.assertEqual(nested['Refresh_Token'], 'abc')
+        self.assertIs(masked['tasks'][1], unchanged)
+        self.assertIs(masked['tokens'], data['tokens'])
+        self.assertIs(mask_sensitive_args(unchanged), unchanged)
+        self.assertEqual(mask_sensitive_args(('a', {'secret': 1})), ('a', {'secret': MASK}))
+
+    def test_limits(self):
+        with override_settings(VALUES=settings.VALUES | {'LOG_MASK_MAX_DEPTH': 2, 'LOG_MASK_MAX_ITEMS': 3}):
+            self.assertDictEqual(mask_sensitive_args({'a': {'b': {'token': 1}}, 'c': [[1]]}), {'a': {'b': '{1 items}'}, 'c': ['[1 items]']})
+            self.assertListEqual(mask_sensitive_args(list(range(5))), [0, 1, 2, '... 2 more'])
+            self.assertDictEqual(mask_sensitive_args(dict.fromkeys('abcd', 1)), {'a': 1, 'b': 1, 'c': 1, '...': '1 more'})
+
+
+class RequestLogSamplingTest(APITestCase):
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create(first_name='nilva', last_name='man', email='nilva.man@test.com'))
+
+    @staticmethod
+    def decisions(decision):
+        return REGISTRY.get_sample_value('pishkhan_restapi_request_logs_total', {'decision': decision}) or 0
+
+    def test_sampling(self):
+        values = settings.VALUES | {'LOG_SAMPLE_RATE': 0, 'LOG_SLOW_REQUEST_THRESHOLDS': {'task_list': 60}}
+        with override_settings(VALUES=values), patch.dict('project.log_sampling.VALUES', values):
+            dropped = self.decisions('dropped')
+            with self.assertNoLogs('requests_logger'):
+                self.client.get(reverse('tasks:task_list'))
+            self.assertEqual(self.decisions('dropped'), dropped + 1)
+
+            with self.assertLogs('requests_logger') as logs:
+                self.client.post(reverse('tasks:task_list'), {'title': 'no send time'}, format='json')
+                self.client.get(reverse('tasks:task_export'), {'send_time__gte': 'not a time'})
+            self.assertListEqual([record.log_decision for record in logs.records], ['error', 'error'])
+
+            with patch.dict('project.log_sampling.VALUES', {'LOG_SLOW_REQUEST_THRESHOLD': 0}), self.assertLogs('requests_logger') as logs:
+                self.client.get(reverse('tasks:task_export'))
+                self.client.get(reverse('tasks:task_list'))
+            self.assertListEqual([record.route_name for record in logs.records], ['task_export'])
+            self.assertEqual(logs.records[0].log_decision, 'slow')
+
+    def test_sampled(self):
+        request_ids = [f'{i:032x}' for i in range(1000)]
+        kept = [request_id for request_id in request_ids if sampled(request_id, 0.1)]
+        self.assertAlmostEqual(len(kept), 100, delta=30)
+        self.assertListEqual([request_id for request_id in request_ids if sampled(request_id, 0.1)], kept)
+
+    def test_body_budget(self):
+        large = json.dumps({'title': 'x' * 100, 'send_time': '2020-05-10 10:30'})
+        with patch.dict('project.log_sampling.VALUES', {'LOG_BODY_MAX_BYTES': 64}), self.assertLogs('requests_logger') as logs:
+            response = self.client.post(reverse('tasks:task_list'), large, content_type='application/json')
+            self.client.post(reverse('tasks:task_list'), {'title': 'x', 'password': 'y'}, format='json')
+        # the view read the large body itself, the log only has its hash
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertDictEqual(logs.records[0].request_body, {'sha256': sha256(large.encode()).hexdigest(), 'length': len(large), 'complete': True})
+        self.assertDictEqual(logs.records[1].request_body, {'title': 'x', 'password': MASK})
+
+
+class KafkaLogTest(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.broker = InMemoryBroker()
+        self.shipper = KafkaShipper(lambda: self.broker, batch_size=2, spill_path=os.path.join(directory.name, 'spill.log'),
+                                    spill_max_bytes=1024, retry_interval=60)
+        # no flusher thread, the test flushes
+        self.shipper.pid = os.getpid()
+
+    def log(self, topic, message):
+        handler = KafkaHandler(topic, shipper=self.shipper)
+        handler.setFormatter(TaskSchedulerJsonFormatter())
+        record = logging.LogRecord('kafka-test', logging.INFO, __file__, 0, message, None, None)
+        handler.handle(record)
+
+    def messages(self, topic):
+        return [json.loads(message)['message'] for message in self.broker.topics[topic]]
+
+    @staticmethod
+    def records(outcome):
+        return REGISTRY.get_sample_value('pishkhan_restapi_kafka_log_records_total', {'outcome': outcome}) or 0
+
+    def test_batches(self):
+        for i in range(3):
+            self.log('requests', f'request {i}')
+        self.log('jobs', 'job')
+        self.assertEqual(self.shipper.flush(), 4)
+        self.assertListEqual(self.messages('requests'), ['request 0', 'request 1', 'request 2'])
+        self.assertListEqual(self.messages('jobs'), ['job'])
+
+    def test_spill(self):
+        spilled, replayed, dropped = self.records('spilled'), self.records('replayed'), self.records('dropped')
+        self.broker.down = True
+        for i in range(3):
+            self.log('requests', f'request {i}')
+        self.shipper.flush()
+        self.assertEqual(self.records('spilled'), spilled + 3)
+        # while the broker is down nothing is tried, and the spill file is bounded
+        self.broker.down = False
+        for i in range(3, 40):
+            self.log('requests', f'request {i}')
+        self.shipper.flush()
+        self.assertDictEqual(self.broker.topics, {})
+        self.assertLessEqual(os.path.getsize(self.shipper.spill_path), 1024)
+        self.assertGreater(self.records('dropped'), dropped)
+
+        self.shipper.retry_at = 0
+        self.log('requests', 'request 40')
+        self.shipper.flush()
+        messages = self.messages('requests')
+        self.assertListEqual(messages[:3], ['request 0', 'request 1', 'request 2'])
+        self.assertEqual(messages[-1], 'request 40')
+        self.assertEqual(self.records('replayed'), replayed + len(messages) - 1)
+        self.assertFalse(os.path.exists(self.shipper.spill_path))
+
+    def test_no_transport(self):
+        attempts = []
+
+        def make_transport():
+            attempts.append(1)
+            raise ImportError('no kafka')
+
+        self.shipper.make_transport = make_transport
+        spilled = self.records('spilled')
+        for i in range(3):
+            self.log('requests', f'request {i}')
+        self.shipper.flush()
+        self.log('requests', 'request 3')
+        self.shipper.flush()
+        # one failed attempt, then the broker counts as down until the retry interval passes
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(self.records('spilled'), spilled + 4)
+
+        self.shipper.make_transport = lambda: self.broker
+        self.shipper.retry_at = 0
+        self.shipper.flush()
+        self.assertListEqual(self.messages('requests'), ['request 0', 'request 1', 'request 2', 'request 3'])
+
+    def test_orphaned_replay(self):
+        # a worker that died while replaying left its replay file behind
+        orphan = f'{self.shipper.spill_path}.999999999.replay'
+        orphaned = json.dumps({'message': 'orphaned', 'padding': 'x' * 1000}).encode()
+        with open(orphan, 'wb') as file:
+            file.write(b'requests\t' + orphaned + b'\n')
+        dropped = self.records('dropped')
+        self.shipper.retry_at = time.monotonic() + 60
+        self.log('requests', 'request 0')
+        self.shipper.flush()
+        # the orphan counts against the spill budget
+        self.assertEqual(self.records('dropped'), dropped + 1)
+
+        self.shipper.retry_at = 0
+        self.log('requests', 'request 1')
+        self.shipper.flush()
+        self.assertFalse(os.path.exists(orphan))
+        self.assertListEqual(self.broker.topics['requests'][:1], [orphaned])
+        self.assertListEqual(self.messages('requests')[1:], ['request 1'])
+
+
+class ExceptionRateTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = patch.dict('project.exception_rates.VALUES', {'EXCEPTION_METRICS_PREFIX': 'exception-rate-test', 'EXCEPTION_METRICS_TTL': 60})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: settings.REDIS_CONNECTION.delete(*settings.REDIS_CONNECTION.keys('exception-rate-test:*') or ['-']))
+
+    def test_rates(self):
+        with patch('project.exception_rates.time.time', return_value=1000.5):
+            for _ in range(30):
+                record_exception('task_list', ValueError())
+            record_exception('task_detail', KeyError())
+        with patch('project.exception_rates.time.time', return_value=1010):
+            record_exception('task_list', ValueError())
+            # one hash per second, however many exceptions
+            self.assertEqual(len(settings.REDIS_CONNECTION.keys('exception-rate-test:*')), 2)
+            self.assertDictEqual(exception_rates(), {('task_list', 'ValueError'): 31 / 60, ('task_detail', 'KeyError'): 1 / 60})
+            self.assertDictEqual(exception_counts(window=5), {('task_list', 'ValueError'): 1})
+        self.assertLessEqual(settings.REDIS_CONNECTION.ttl('exception-rate-test:1010'), 61)
+
+    def test_gauge(self):
+        collector = labeled_gauge_metric_generator(lambda: {('task_list', 'ValueError'): 0.5}, 'exception_rate_test', labelnames=['route', 'exception'])
+        # registering describes the collector without reading its values
+        with patch.object(collector, 'collect') as collect:
+            CollectorRegistry(auto_describe=True).register(collector)
+        collect.assert_not_called()
+        # collectors report the value read by the previous scrape
+        self.assertListEqual(next(collector.collect()).samples, [])
+        self.wait_for(lambda: next(collector.collect()).samples)
+        sample, = next(collector.collect()).samples
+        self.assertEqual(sample.name, 'pishkhan_restapi_exception_rate_test')
+        self.assertDictEqual(sample.labels, {'route': 'task_list', 'exception': 'ValueError'})
+        self.assertEqual(sample.value, 0.5)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
@@ -0,0 +1,71 @@
+"""
+Per-request phase timings.
+
+`ResponseLogMiddleware` puts a `RequestTimer` on every request, so concurrent requests (greenlets
+under gevent) never share timing state. The timer keeps `perf_counter_ns` marks for the phases
+the middleware sees and the time spent in database queries, and turns them into the
+`timing_*` fields of the request log, in milliseconds.
+"""
+from contextlib import ExitStack, contextmanager
+from time import perf_counter_ns
+
+from django.db import connections
+
+# phase: (mark it starts at, mark it ends at)
+PHASES = {
+    'request': ('start', 'view'),
+    'view': ('view', 'view_returned'),
+    'render': ('view_returned', 'rendered'),
+    'response': ('rendered', 'response'),
+}
+
+
+class RequestTimer:
+    """ monotonic marks of one request, and its database time and query count. """
+
+    def __init__(self):
+        self.marks = {'start': perf_counter_ns()}
+        self.db_ns = 0
+        self.db_queries = 0
+
+    def mark(self, name):
+        self.marks[name] = perf_counter_ns()
+
+    def elapsed(self):
+        """ seconds since the request came in. """
+        return (perf_counter_ns() - self.marks['start']) / 1e9
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = perf_counter_ns()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ns += perf_counter_ns() - start
+            self.db_queries += 1
+
+    @contextmanager
+    def timing_queries(self):
+        """ count the time of every query made on this thread's connections in the block. """
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self.execute_wrapper))
+            yield
+
+    def fields(self):
+        """
+        `timing_<phase>` for every phase whose marks were both made, plus database time and
+        queries. A response that is not rendered (not a template or DRF response) has its view
+        phase run up to the response and no render time.
+        """
+        marks = self.marks
+        if 'view_returned' not in marks and 'view' in marks and 'response' in marks:
+            marks = marks | {'view_returned': marks['response']}
+        if 'rendered' not in marks and 'view_returned' in marks:
+            marks = marks | {'rendered': marks['view_returned']}
+        fields = {
+            f'timing_{phase}': (marks[end] - marks[start]) / 1e6
+            for phase, (start, end) in PHASES.items() if start in marks and end in marks
+        }
+        fields['timing_db'] = self.db_ns / 1e6
+        fields['timing_db_queries'] = self.db_queries
+        return fields
@@ -1,7 +1,10 @@
+import json
 from copy import deepcopy
 from datetime import timedelta
+from functools import lru_cache
+from itertools import islice
 from logging import getLogger
-from re import compile, match, IGNORECASE
+from re import compile, IGNORECASE
 from django.conf import settings
 from django.db.transaction import on_commit
 
@@ -64,15 +67,94 @@ def with_commit(func):
     return wrapper
 
 
+SENSITIVE_KEY = compile(r'password|refresh|code|token|secret', IGNORECASE)
+MASK = "*******"
+
+
+@lru_cache(maxsize=4096)
+def is_sensitive_key(key):
+    return SENSITIVE_KEY.search(str(key)) is not None
+
+
 def mask_sensitive_args(data):
-    patterns = [r'.*password.*', r'.*refresh.*', r'.*code.*', r'.*token.*', r'.*secret.*']
+    """
+    A copy of `data` with the values of sensitive keys masked in every nested dict and list.
+
+    `data` itself is never changed: a container is copied only once something in it has to be
+    masked or cut, and anything with nothing to mask is returned as it is. Containers nested
+    deeper than `LOG_MASK_MAX_DEPTH` are replaced as a whole and only the first
+    `LOG_MASK_MAX_ITEMS` items of a container are kept.
+    """
+    return _mask(data, settings.VALUES['LOG_MASK_MAX_DEPTH'], settings.VALUES['LOG_MASK_MAX_ITEMS'])
+
+
+def _mask(data, depth, max_items):
     if isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, (dict, list)):
-                mask_sensitive_args(value)  # Recursive call for nested dictionaries or arrays
-            elif any([match(pattern, str(key), flags=IGNORECASE) for pattern in patterns]):
-                data[key] = "*******"
-    elif isinstance(data, list):
-        for item in data:
-            mask_sensitive_args(item)  # Recursive call for nested dictionaries or arrays
+        if not depth:
+            return f'{{{len(data)} items}}'
+        masked = None
+        for index, (key, value) in enumerate(data.items()):
+            if index == max_items:
+                masked = masked if masked is not None else dict(islice(data.items(), index))
+                masked['...'] = f'{len(data) - index} more'
+                break
+            if isinstance(value, (dict, list, tuple)):
+                new_value = _mask(value, depth - 1, max_items)
+            elif is_sensitive_key(key):
+                new_value = MASK
+            else:
+                new_value = value
+            if masked is None and new_value is not value:
+                masked = dict(islice(data.items(), index))
+            if masked is not None:
+                masked[key] = new_value
+        return data if masked is None else masked
+    elif isinstance(data, (list, tuple)):
+        if not depth:
+            return f'[{len(data)} items]'
+        masked = None
+        for index, item in enumerate(data):
+            if index == max_items:
+                masked = masked if masked is not None else list(data[:index])
+                masked.append(f'... {len(data) - index} more')
+                break
+            new_item = _mask(item, depth - 1, max_items)
+            if masked is None and new_item is not item:
+                masked = list(data[:index])
+            if masked is not None:
+                masked.append(new_item)
+        if masked is None:
+            return data
+        return masked if isinstance(data, list) else tuple(masked)
     return data
+
+
+def iter_lines(stream, max_size):
+    """ yield lines of a file-like stream one at a time; lines longer than max_size are drained and yielded as None. """
+    while True:
+        line = stream.readline(max_size + 1)
+        if not line:
+            return
+        if len(line) > max_size and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_size)
+            yield None
+            continue
+        yield line
+
+
+def iter_json_array(items, encoder=None, buffer_size=64 * 1024):
+    """ encode an iterable as one json array piece by piece, yielding about `buffer_size` characters at a time. """
+    encode = (encoder or json.JSONEncoder)(separators=(',', ':')).encode
+    buffer, size = ['['], 1
+    for index, item in enumerate(items):
+        piece = encode(item)
+        if index:
+            piece = ',' + piece
+        buffer.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(']')
+    yield ''.join(buffer)
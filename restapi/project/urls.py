@@ -31,6 +31,7 @@ urlpatterns = [
 
     # Supported version1 routes
     # path('api/v1/profile/', include("apps.profile.v1.urls")),
+    path('api/v1/tasks/', include("apps.tasks.v1.urls")),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)